@@ -8,49 +8,87 @@
 - предоставляет функции:
     get_supported_countries() -> List[str]
     get_country_config(code)  -> {"location_id": int, "language": str}
-    canonical_list(code)      -> List[str]
+    canonical_list(code)      -> Tuple[str, ...]
     variants_map(code)        -> Dict[canon, List[variant]]
-    all_variants_for_country(code) -> List[str]
+    get_reverse_index(code)   -> Dict[normalized, canon]
+    all_variants_for_country(code) -> Tuple[str, ...]
     canonicalize(code, s)     -> Optional[canon]
+    match_canon(code, text)   -> Optional[canon] (бренд внутри фразы)
+    normalize_text(s) / ascii_fold(s) / ascii_fold_words(s) -> нормализация строк
 При добавлении новой страны править только этот файл.
 """
 
 from __future__ import annotations
-from typing import Dict, List, Set, Optional
+from functools import lru_cache
+from typing import Dict, List, Set, Optional, Sequence, Tuple
 import re
 import unicodedata
 
 # --------------------- НОРМАЛИЗАЦИЯ ---------------------
 
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+# Latin-1 + Latin Extended-A: символ -> его ASCII-часть после NFKD («é» -> «e», «ß» -> «»).
+# NFKD раскладывает строку посимвольно, так что таблица даёт тот же результат без normalize.
+_LATIN_FOLD = {
+    cp: ''.join(ch for ch in unicodedata.normalize('NFKD', chr(cp)) if ch.isascii())
+    for cp in range(0x80, 0x180)
+}
+
+def _fold_char_words(ch: str) -> str:
+    return ch if ch.isascii() else ('' if unicodedata.combining(ch) else ' ')
+
+# то же для токенизации: несводимый к ASCII остаток («ł», «ß», «•», «·») -> пробел, а не пусто
+_LATIN_FOLD_WORDS = {
+    cp: ''.join(_fold_char_words(ch) for ch in unicodedata.normalize('NFKD', chr(cp)))
+    for cp in range(0x80, 0x180)
+}
+
+def ascii_fold(s: str) -> str:
+    """
+    Снимает диакритику и выбрасывает не-ASCII (как NFKD + encode('ascii', 'ignore')).
+    Границы слов на не-ASCII разделителях («Betano•Sports») теряются — для токенов см. ascii_fold_words.
+    """
+    if s.isascii():
+        return s
+    if max(s) <= '\u017f':
+        return s.translate(_LATIN_FOLD)
+    return unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode()
+
+def ascii_fold_words(s: str) -> str:
+    """Как ascii_fold, но несводимый к ASCII символ становится пробелом (граница слова)."""
+    if s.isascii():
+        return s
+    if max(s) <= '\u017f':
+        return s.translate(_LATIN_FOLD_WORDS)
+    return ''.join(_fold_char_words(ch) for ch in unicodedata.normalize('NFKD', s))
+
+@lru_cache(maxsize=None)
 def normalize_text(s: str) -> str:
     """lower + remove diacritics + keep only a-z0-9"""
-    s = (s or "").strip().lower()
-    s = ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
-    return re.sub(r'[^a-z0-9]+', '', s)
+    return normalize_text_prelower((s or "").strip().lower())
+
+def normalize_text_prelower(s: str) -> str:
+    """normalize_text для строки, уже прошедшей strip().lower()."""
+    return _NON_ALNUM_RE.sub('', ascii_fold(s))
 
 def uniq(seq: List[str]) -> List[str]:
-    out, seen = [], set()
+    # dict сохраняет порядок вставки: lower -> первое встреченное написание
+    seen: Dict[str, str] = {}
     for x in seq:
         k = (x or "").strip()
-        if not k:
-            continue
-        lk = k.lower()
-        if lk in seen:
-            continue
-        seen.add(lk)
-        out.append(k)
-    return out
+        if k:
+            seen.setdefault(k.lower(), k)
+    return list(seen.values())
 
 def _base_variants(canon: str) -> List[str]:
     """
     Базовые варианты: канон, lower, "склейка" без пробелов/точек/плюсов.
     Эти формы достаточны для KeywordTool/маппинга; шум не раздуваем.
     """
-    v = [canon, canon.lower()]
-    glued = normalize_text(canon)
-    if glued and glued != canon.lower():
-        v.append(glued)
-    return uniq(v)
+    lc = canon.lower()
+    glued = normalize_text_prelower(lc.strip())
+    return uniq([canon, lc] + ([glued] if glued and glued != lc else []))
 
 # --------------------- КОНФИГ СТРАН ---------------------
 
@@ -78,7 +116,7 @@ def get_country_config(code: str) -> Dict[str, object]:
 # ВАЖНО: канонические списки — только они попадают в итоговые CSV.
 # Варианты/синонимы мы генерируем ниже и используем лишь для запросов/маппинга.
 
-CANON_BY_COUNTRY: Dict[str, List[str]] = {
+CANON_BY_COUNTRY: Dict[str, Sequence[str]] = {
     "ar": uniq([
         "Betano","Bet365","Codere","Betsson","bplay","BetWarrior","Jugadón","City Center Online",
         "Casino Magic Online","Casino Club Online","Casino Buenos Aires Online","Palermo Online","Casino del Río Online",
@@ -155,6 +193,9 @@ CANON_BY_COUNTRY: Dict[str, List[str]] = {
     ]),
 }
 
+# замораживаем каноны: кортежи неизменяемы, поэтому canonical_list() отдаёт их без копии
+CANON_BY_COUNTRY = {c: tuple(uniq(v)) for c, v in CANON_BY_COUNTRY.items()}
+
 # --------------------- ДОП. АЛИАСЫ/ВАРИАНТЫ ---------------------
 
 EXTRA_ALIASES_BY_COUNTRY: Dict[str, Dict[str, List[str]]] = {
@@ -177,7 +218,7 @@ EXTRA_ALIASES_BY_COUNTRY: Dict[str, Dict[str, List[str]]] = {
 
 # --------------------- ПОСТРОЕНИЕ ВАРИАНТОВ И ОБРАТНОГО ИНДЕКСА ---------------------
 
-def _build_variants_map(canon_list: List[str], extras: Dict[str, List[str]]) -> Dict[str, List[str]]:
+def _build_variants_map(canon_list: Sequence[str], extras: Dict[str, List[str]]) -> Dict[str, List[str]]:
     out: Dict[str, List[str]] = {}
     for c in canon_list:
         vs = _base_variants(c) + extras.get(c, [])
@@ -191,9 +232,28 @@ def _make_reverse_index(variants_map: Dict[str, List[str]]) -> Dict[str, str]:
             rev[normalize_text(v)] = canon
     return rev
 
-# Кешируем рассчитанные мапы, чтобы не собирать каждый раз
+# Ключ узла префиксного дерева, под которым лежит канон (символы в дереве — только a-z0-9)
+_TRIE_CANON = "$"
+# Минимальная длина совпадения при поиске бренда внутри фразы (короткие бренды дают шум)
+_MIN_PHRASE_MATCH = 4
+
+def _make_trie(reverse_index: Dict[str, str]) -> Dict[str, object]:
+    """Префиксное дерево (dict-of-dicts) по нормализованным вариантам."""
+    root: Dict[str, object] = {}
+    for key, canon in reverse_index.items():
+        if not key:
+            continue
+        node = root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[_TRIE_CANON] = canon
+    return root
+
+# Кешируем рассчитанные мапы (собираются один раз при импорте, см. ниже)
 _VARIANTS_CACHE: Dict[str, Dict[str, List[str]]] = {}
 _REVERSE_CACHE: Dict[str, Dict[str, str]] = {}
+_TRIE_CACHE: Dict[str, Dict[str, object]] = {}
+_ALL_VARIANTS_CACHE: Dict[str, Tuple[str, ...]] = {}
 
 def _ensure_country_built(code: str) -> None:
     code = (code or "").lower()
@@ -205,35 +265,62 @@ def _ensure_country_built(code: str) -> None:
         variants = _build_variants_map(canon, extras)
         _VARIANTS_CACHE[code] = variants
         _REVERSE_CACHE[code] = _make_reverse_index(variants)
+        _TRIE_CACHE[code] = _make_trie(_REVERSE_CACHE[code])
+        acc: Set[str] = set()
+        for arr in variants.values():
+            acc.update(arr)
+        # ВАЖНО: стабильный порядок (по алфавиту), чтобы батчи были воспроизводимы
+        _ALL_VARIANTS_CACHE[code] = tuple(sorted(acc))
+
+def _built_code(code: str) -> str:
+    code = (code or "").lower()
+    if code not in _VARIANTS_CACHE:
+        raise KeyError(f"Unknown country code for brands: {code}")
+    return code
 
 # --------------------- ПУБЛИЧНЫЕ ХЕЛПЕРЫ (используются в других скриптах) ---------------------
 
-def canonical_list(code: str) -> List[str]:
-    """Канонический список брендов (то, что пойдёт в итоговый CSV)."""
+def canonical_list(code: str) -> Tuple[str, ...]:
+    """Канонический список брендов (то, что пойдёт в итоговый CSV). Неизменяемый — не копируем."""
     code = (code or "").lower()
     if code not in CANON_BY_COUNTRY:
         raise KeyError(f"Unknown country code: {code}")
-    return CANON_BY_COUNTRY[code][:]
+    return CANON_BY_COUNTRY[code]
 
 def variants_map(code: str) -> Dict[str, List[str]]:
     """Словарь: canon -> [variants...] (для запросов/маппинга)."""
-    _ensure_country_built(code)
-    return _VARIANTS_CACHE[code]
-
-def all_variants_for_country(code: str) -> List[str]:
-    """Плоский список всех вариантов (уникальных) для страны (для запросов в API)."""
-    vm = variants_map(code)
-    acc: Set[str] = set()
-    for arr in vm.values():
-        acc.update(arr)
-    # ВАЖНО: возвращаем в стабильном порядке (по алфавиту), чтобы батчи были воспроизводимы
-    return sorted(acc)
+    return _VARIANTS_CACHE[_built_code(code)]
+
+def get_reverse_index(code: str) -> Dict[str, str]:
+    """Словарь: normalize_text(variant) -> canon (для маппинга в горячих циклах)."""
+    return _REVERSE_CACHE[_built_code(code)]
+
+def all_variants_for_country(code: str) -> Tuple[str, ...]:
+    """Плоский список всех вариантов (уникальных, по алфавиту) для страны (для запросов в API)."""
+    return _ALL_VARIANTS_CACHE[_built_code(code)]
 
 def canonicalize(code: str, s: str) -> Optional[str]:
     """Вернуть канон по произвольной строке (варианту)."""
-    _ensure_country_built(code)
-    key = normalize_text(s)
-    return _REVERSE_CACHE[code].get(key)
+    return get_reverse_index(code).get(normalize_text(s))
+
+def match_canon(code: str, text: str) -> Optional[str]:
+    """
+    Найти бренд внутри фразы: самое длинное вхождение нормализованного варианта
+    в normalize_text(text). Нужен, когда точный canonicalize() промахивается.
+    """
+    s = normalize_text(text)
+    trie = _TRIE_CACHE[_built_code(code)]
+    best, best_len = None, 0
+    for i in range(len(s)):
+        node = trie
+        for j in range(i, len(s)):
+            node = node.get(s[j])
+            if node is None:
+                break
+            canon = node.get(_TRIE_CANON)
+            if canon is not None and j + 1 - i > best_len:
+                best, best_len = canon, j + 1 - i
+    return best if best_len >= _MIN_PHRASE_MATCH else None
 
 def get_country_title(code: str) -> str:
     """Человеко-читаемое имя страны (для таблиц/вывода)."""
@@ -246,6 +333,10 @@ def get_country_language(code: str) -> str:
 def get_country_location_id(code: str) -> int:
     return int(get_country_config(code)["location_id"])
 
+# Справочник статичен — собираем варианты и обратные индексы всех стран сразу при импорте
+for _code in CANON_BY_COUNTRY:
+    _ensure_country_built(_code)
+
 # --------------------- ШАБЛОН ДОБАВЛЕНИЯ НОВОЙ СТРАНЫ ---------------------
 """
 Чтобы добавить новую страну (например, MX):
@@ -10,11 +10,31 @@ keywordtool_fetch.py
 
 import argparse
 import csv
+import hashlib
 import json
+import os
+import threading
 import time
-from typing import Dict, List, Iterable, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Iterable, Tuple, Optional, Sequence
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:  # orjson опционален: быстрее, но без него всё работает на stdlib json
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> str:
+        # тот же компактный формат, что и у orjson
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    _loads = json.loads
 
 from brands_catalog import (
     get_supported_countries,
@@ -23,19 +43,50 @@ from brands_catalog import (
     get_country_title,
     canonical_list,
     all_variants_for_country,
-    canonicalize,
+    get_reverse_index,
+    match_canon,
+    normalize_text,
 )
 
 ENDPOINT = "https://api.keywordtool.io/v2/search/volume/google"
 
+# дисковый кэш ответов KeywordTool (ключ — содержимое запроса без apikey)
+KT_CACHE_DIR = Path(".ktcache")
+
 
 # ------------------------ утилиты ------------------------
 
-def chunked(iterable: List[str], n: int) -> Iterable[List[str]]:
+def chunked(iterable: Sequence[str], n: int) -> Iterable[Sequence[str]]:
     for i in range(0, len(iterable), n):
         yield iterable[i:i + n]
 
 
+def _kt_cache_path(keywords: List[str], metrics_location: int, metrics_language: str, metrics_network: str) -> Path:
+    raw = json.dumps(
+        {"k": sorted(keywords), "l": metrics_language, "loc": metrics_location, "n": metrics_network},
+        ensure_ascii=False,
+    )
+    return KT_CACHE_DIR / f"{hashlib.sha1(raw.encode('utf-8')).hexdigest()}.json"
+
+
+def _read_kt_cache(path: Path, ttl_days: float) -> Optional[Dict]:
+    try:
+        if time.time() - path.stat().st_mtime >= ttl_days * 86400:
+            return None
+        return _loads(path.read_bytes())
+    except (OSError, ValueError):
+        # нет файла/не читается/битый JSON — считаем промахом
+        return None
+
+
+def _write_kt_cache(path: Path, data: Dict) -> None:
+    # пишем во временный файл и атомарно подменяем — параллельные батчи не видят полузаписанный JSON
+    path.parent.mkdir(exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp.write_text(_dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
 def request_keywordtool(
     apikey: str,
     metrics_location: int,
@@ -45,6 +96,7 @@ def request_keywordtool(
     retries: int = 5,
     backoff: float = 1.5,
     timeout: int = 60,
+    session: Optional[requests.Session] = None,
 ) -> Dict:
     """
     Важные поля:
@@ -62,13 +114,14 @@ def request_keywordtool(
         "output": "json",
     }
 
+    http = session or requests
     attempt = 0
     while True:
         attempt += 1
         try:
-            resp = requests.post(ENDPOINT, json=payload, timeout=timeout)
+            resp = http.post(ENDPOINT, json=payload, timeout=timeout)
             if resp.status_code == 200:
-                return resp.json()
+                return _loads(resp.content)
 
             # попытка прочитать тело для диагностики
             try:
@@ -92,41 +145,36 @@ def request_keywordtool(
 
 
 def _coerce_num(x):
+    # float() сначала: "1200.5" не гоняем через исключение от int()
+    if x is None:
+        return None
     try:
-        return int(x)
-    except Exception:
-        try:
-            return float(x)
-        except Exception:
-            return None
+        v = float(x)
+    except (TypeError, ValueError):
+        return None
+    return int(v) if v.is_integer() else v
 
 
-def flatten_results(data: Dict, country_code: str, language_code: str) -> List[Dict]:
-    """
-    Универсальная нормализация ответа KeywordTool.
-    Поддерживает варианты:
-      - {"results": {"kw": {...}, ...}}
-      - {"results": [ {...}, ... ]}
-      - {"keywords": {"kw": {...}}}
-      - {"data": {...}}
+# m1..m12 — помесячные объёмы в ответе KeywordTool
+_MONTH_KEYS = tuple(f"m{i}" for i in range(1, 13))
 
-    Маппинг:
-      volume -> search_volume
-      cmp    -> competition
-      m1..m12 -> trend (список)
-    """
-    results = data.get("results") or data.get("data") or data.get("keywords") or {}
-    items: List[Dict] = []
 
+def _iter_result_items(results) -> Iterable[Tuple[str, Dict]]:
+    """
+    Форма ответа определяется один раз на payload; отдаём пары (keyword, metrics)
+    без копирования метрик в новый dict на каждую строку.
+    """
     if isinstance(results, list):
         # редкий случай: список объектов с ключами
-        items = [obj for obj in results if isinstance(obj, dict)]
+        for obj in results:
+            if isinstance(obj, dict):
+                yield obj.get("string", ""), obj
     elif isinstance(results, dict) and "keywords" in results:
         for kw, metrics in (results["keywords"] or {}).items():
-            m = {"string": kw}
             if isinstance(metrics, dict):
-                m.update(metrics)
-            items.append(m)
+                yield metrics.get("string", kw), metrics
+            else:
+                yield kw, {}
     elif isinstance(results, dict):
         # обычный: словарь kw -> metrics
         for kw, metrics in results.items():
@@ -135,25 +183,34 @@ def flatten_results(data: Dict, country_code: str, language_code: str) -> List[D
             # пропускаем служебные ключи (напр. "status") без метрик
             if not any(k in metrics for k in ("volume", "search_volume", "m1", "string")):
                 continue
-            m = {"string": metrics.get("string", kw)}
-            m.update(metrics)
-            items.append(m)
+            yield metrics.get("string", kw), metrics
+
+
+def flatten_results(data: Dict, country_code: str, language_code: str) -> List[Dict]:
+    """
+    Универсальная нормализация ответа KeywordTool.
+    Поддерживает варианты:
+      - {"results": {"kw": {...}, ...}}
+      - {"results": [ {...}, ... ]}
+      - {"keywords": {"kw": {...}}}
+      - {"data": {...}}
+
+    Маппинг:
+      volume -> search_volume
+      cmp    -> competition
+      m1..m12 -> trend (список)
+    """
+    results = data.get("results") or data.get("data") or data.get("keywords") or {}
 
     out: List[Dict] = []
-    for it in items:
-        kw = it.get("string", "")
-        vol = it.get("search_volume", it.get("volume"))
+    for kw, it in _iter_result_items(results):
+        # прямой доступ: запасной ключ читаем только если основного нет
+        vol = it["search_volume"] if "search_volume" in it else it.get("volume")
         cpc = it.get("cpc")
-        cmp_ = it.get("competition", it.get("cmp"))
-
-        trend_vals = []
-        any_month = False
-        for i in range(1, 13):
-            key = f"m{i}"
-            if key in it:
-                any_month = True
-                trend_vals.append(_coerce_num(it.get(key)))
-        if not any_month:
+        cmp_ = it["competition"] if "competition" in it else it.get("cmp")
+
+        trend_vals = [_coerce_num(it[k]) for k in _MONTH_KEYS if k in it]
+        if not trend_vals:
             # у некоторых аккаунтов приходит "trend": число
             t = it.get("trend")
             if t is not None:
@@ -166,18 +223,28 @@ def flatten_results(data: Dict, country_code: str, language_code: str) -> List[D
             "search_volume": _coerce_num(vol),
             "cpc": _coerce_num(cpc),
             "competition": _coerce_num(cmp_),
-            "trend": json.dumps(trend_vals, ensure_ascii=False),
+            "trend": trend_vals,  # список; в JSON кодируем только при записи CSV
         })
 
     return out
 
 
-def write_csv(path: str, rows: List[Dict]):
-    fields = ["keyword", "country", "language", "search_volume", "cpc", "competition", "trend"]
+CSV_FIELDS = ["keyword", "country", "language", "search_volume", "cpc", "competition", "trend"]
+
+
+def _csv_row(r: Dict) -> Tuple:
+    # порядок строго как в CSV_FIELDS — пишем кортежем, без DictWriter
+    return (
+        r["keyword"], r["country"], r["language"], r["search_volume"],
+        r["cpc"], r["competition"], _dumps(r["trend"] or []),
+    )
+
+
+def write_csv(path: str, rows: Iterable[Dict]):
     with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fields)
-        w.writeheader()
-        w.writerows(rows)
+        w = csv.writer(f)
+        w.writerow(CSV_FIELDS)
+        w.writerows(map(_csv_row, rows))
 
 
 def summarize(rows: List[Dict], title: str, topn: int = 10):
@@ -193,21 +260,22 @@ def summarize(rows: List[Dict], title: str, topn: int = 10):
         print(f"{i:>2}. {r['keyword']} — {r.get('search_volume')}")
 
 
-def aggregate_to_canonical(rows: List[Dict], country_code: str) -> List[Dict]:
+def aggregate_into(agg: Dict[str, Dict], rows: Iterable[Dict], country_code: str) -> None:
     """
-    Сворачиваем вариации в канон по MAX(search_volume).
-    В CSV уходит один ряд на канон.
+    Онлайн-версия агрегации: докладываем очередной батч строк в agg
+    (canon -> лучший по объёму ряд), не держа в памяти все варианты.
     """
-    agg: Dict[str, Dict] = {}
+    rev = get_reverse_index(country_code)
     for r in rows:
         variant = r.get("keyword", "")
-        canon = canonicalize(country_code, variant)
+        canon = rev.get(normalize_text(variant)) or match_canon(country_code, variant)
         if not canon:
             # вариант не привязался к канону — игнорируем
             continue
 
         sv = r.get("search_volume") or 0
-        if canon not in agg:
+        best = agg.get(canon)
+        if best is None:
             agg[canon] = {
                 "keyword": canon,
                 "country": country_code,
@@ -217,14 +285,21 @@ def aggregate_to_canonical(rows: List[Dict], country_code: str) -> List[Dict]:
                 "competition": r.get("competition"),
                 "trend": r.get("trend"),
             }
-        else:
-            if (sv or 0) > (agg[canon]["search_volume"] or 0):
-                # переносим метрики с лучшего (по объёму) варианта
-                agg[canon]["search_volume"] = sv
-                agg[canon]["cpc"] = r.get("cpc")
-                agg[canon]["competition"] = r.get("competition")
-                agg[canon]["trend"] = r.get("trend")
+        elif sv > (best["search_volume"] or 0):
+            # переносим метрики с лучшего (по объёму) варианта
+            best["search_volume"] = sv
+            best["cpc"] = r.get("cpc")
+            best["competition"] = r.get("competition")
+            best["trend"] = r.get("trend")
+
 
+def aggregate_to_canonical(rows: List[Dict], country_code: str) -> List[Dict]:
+    """
+    Сворачиваем вариации в канон по MAX(search_volume).
+    В CSV уходит один ряд на канон.
+    """
+    agg: Dict[str, Dict] = {}
+    aggregate_into(agg, rows, country_code)
     return list(agg.values())
 
 
@@ -234,47 +309,44 @@ def _result_filename(code: str) -> str:
 
 # ------------------------ health-check ------------------------
 
-def health_check(api_key: str, countries: List[str]):
+def health_check(
+    api_key: str,
+    countries: List[str],
+    session: Optional[requests.Session] = None,
+    workers: int = 4,
+):
     """
-    Мини-проверка: делает по одному тесту на страну + общий контроль.
+    Мини-проверка: по одному тесту на страну, запросы уходят параллельно.
+    Отдельный «общий» тест не нужен — он бил в ту же локаль, что и первая страна.
     Не критично для работы, можно отключить --skip-health.
     """
     print("\n--- HEALTH CHECK ---")
-    # общий тест
-    try:
+
+    def _probe(c: str) -> int:
+        sample = canonical_list(c)[:3] or ["test"]
         data = request_keywordtool(
             apikey=api_key,
-            metrics_location=get_country_location_id(countries[0]),
-            metrics_language=get_country_language(countries[0]),
-            keywords=["google", "facebook"],
+            metrics_location=get_country_location_id(c),
+            metrics_language=get_country_language(c),
+            keywords=sample,
             metrics_network="googlesearchnetwork",
             retries=2,
             backoff=1.3,
             timeout=30,
+            session=session,
         )
         blk = data.get("results") or data.get("data") or data.get("keywords") or {}
-        print("[global] ok, sample parsed keys:", (list(blk)[:3] if isinstance(blk, dict) else "list"))
-    except Exception as e:
-        print("[global] failed:", e)
+        return len(blk)
 
-    # по стране
-    for c in countries:
-        try:
-            sample = canonical_list(c)[:3] or ["test"]
-            data = request_keywordtool(
-                apikey=api_key,
-                metrics_location=get_country_location_id(c),
-                metrics_language=get_country_language(c),
-                keywords=sample,
-                metrics_network="googlesearchnetwork",
-                retries=2,
-                backoff=1.3,
-                timeout=30,
-            )
-            blk = data.get("results") or data.get("data") or data.get("keywords") or {}
-            print(f"[{c}] ok, sample size:", (len(blk) if isinstance(blk, dict) else len(blk)))
-        except Exception as e:
-            print(f"[{c}] failed:", e)
+    # размер пула ограничивает всплеск одновременных запросов к API
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(countries)))) as ex:
+        futures = {ex.submit(_probe, c): c for c in countries}
+        for fut in as_completed(futures):
+            c = futures[fut]
+            try:
+                print(f"[{c}] ok, sample size:", fut.result())
+            except Exception as e:
+                print(f"[{c}] failed:", e)
 
 
 # ------------------------ основной сценарий ------------------------
@@ -289,10 +361,16 @@ def fetch_for_country(
     retries: int,
     backoff: float,
     timeout: int,
+    session: Optional[requests.Session] = None,
+    workers: int = 1,
+    cache_ttl_days: Optional[float] = None,
 ) -> List[Dict]:
     """
     Возвращает канонически агрегированные строки для страны.
     Также пишет country_results.csv на диск.
+    Батчи уходят параллельно (workers потоков); пауза sleep_between
+    выдерживается на каждом «слоте», а не глобально.
+    cache_ttl_days=None — без дискового кэша (.ktcache/).
     """
     lang = get_country_language(country_code)
     loc_id = get_country_location_id(country_code)
@@ -301,22 +379,46 @@ def fetch_for_country(
     keywords = canonical_list(country_code) if only_canon else all_variants_for_country(country_code)
     print(f"{country_code.upper()} keywords total (to query): {len(keywords)}")
 
-    rows_variants: List[Dict] = []
-    for chunk in chunked(keywords, batch_size):
-        data = request_keywordtool(
-            apikey=api_key,
-            metrics_location=loc_id,
-            metrics_language=lang,
-            keywords=chunk,
-            metrics_network=metrics_network,
-            retries=retries,
-            backoff=backoff,
-            timeout=timeout,
-        )
-        rows_variants.extend(flatten_results(data, country_code, lang))
-        time.sleep(sleep_between)
+    # слот занимается на время запроса и освобождается через sleep_between после него
+    slots = threading.Semaphore(max(1, workers))
 
-    rows_canon = aggregate_to_canonical(rows_variants, country_code)
+    def _fetch_batch(chunk: List[str]) -> List[Dict]:
+        # дисковый кэш ведём здесь (один lookup на батч); попадание — без сети,
+        # поэтому ни слот, ни паузу не занимаем
+        cache_path = None
+        if cache_ttl_days is not None:
+            cache_path = _kt_cache_path(chunk, loc_id, lang, metrics_network)
+            cached = _read_kt_cache(cache_path, cache_ttl_days)
+            if cached is not None:
+                return flatten_results(cached, country_code, lang)
+
+        slots.acquire()
+        try:
+            data = request_keywordtool(
+                apikey=api_key,
+                metrics_location=loc_id,
+                metrics_language=lang,
+                keywords=chunk,
+                metrics_network=metrics_network,
+                retries=retries,
+                backoff=backoff,
+                timeout=timeout,
+                session=session,
+            )
+        finally:
+            threading.Timer(sleep_between, slots.release).start()
+        if cache_path is not None:
+            _write_kt_cache(cache_path, data)
+        return flatten_results(data, country_code, lang)
+
+    # агрегируем по мере прихода батчей — сырые варианты целиком не копим;
+    # map отдаёт результаты в порядке батчей, так что итог детерминирован
+    agg: Dict[str, Dict] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        for rows in ex.map(_fetch_batch, list(chunked(keywords, batch_size))):
+            aggregate_into(agg, rows, country_code)
+
+    rows_canon = list(agg.values())
     out_path = _result_filename(country_code)
     write_csv(out_path, rows_canon)
     summarize(rows_canon, f"{title} ({lang})")
@@ -345,33 +447,62 @@ def main():
     parser.add_argument("--retries", type=int, default=5, help="Повторы KeywordTool")
     parser.add_argument("--backoff", type=float, default=1.5, help="Экспоненциальный бэкофф")
     parser.add_argument("--timeout", type=int, default=60, help="HTTP timeout, сек")
+    parser.add_argument("--workers", type=int, default=4, help="Параллельных запросов к KeywordTool")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш ответов (.ktcache/)")
+    parser.add_argument("--cache-ttl-days", type=float, default=3, help="TTL кэша ответов KeywordTool (дни)")
     args = parser.parse_args()
 
     # список стран к запуску
     countries = get_supported_countries() if args.country == "all" else [args.country]
 
+    # одна сессия на весь запуск — keep-alive и пул соединений к KeywordTool;
+    # пул не меньше числа потоков, иначе лишние соединения будут закрываться после запроса
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(1, args.workers)))
+
     if not args.skip_health:
-        health_check(args.api_key, countries)
-
-    all_rows: List[Dict] = []
-    for code in countries:
-        rows = fetch_for_country(
-            api_key=args.api_key,
-            country_code=code,
-            only_canon=args.no_variants,
-            batch_size=args.batch_size,
-            metrics_network=args.metrics_network,
-            sleep_between=args.sleep,
-            retries=args.retries,
-            backoff=args.backoff,
-            timeout=args.timeout,
-        )
-        all_rows.extend(rows)
+        health_check(args.api_key, countries, session=session, workers=args.workers)
+
+    # если запускаем по нескольким странам — общий CSV пишем потоково, по мере готовности стран,
+    # во временный файл: прошлый all_results.csv подменяем только после успеха по всем странам
+    all_path = "all_results.csv"
+    all_tmp = f"{all_path}.tmp"
+    all_fh = open(all_tmp, "w", newline="", encoding="utf-8") if len(countries) > 1 else None
+    done = False
+    try:
+        all_writer = None
+        if all_fh is not None:
+            all_writer = csv.writer(all_fh)
+            all_writer.writerow(CSV_FIELDS)
+
+        for code in countries:
+            rows = fetch_for_country(
+                api_key=args.api_key,
+                country_code=code,
+                only_canon=args.no_variants,
+                batch_size=args.batch_size,
+                metrics_network=args.metrics_network,
+                sleep_between=args.sleep,
+                retries=args.retries,
+                backoff=args.backoff,
+                timeout=args.timeout,
+                session=session,
+                workers=args.workers,
+                cache_ttl_days=None if args.no_cache else args.cache_ttl_days,
+            )
+            if all_writer is not None:
+                all_writer.writerows(map(_csv_row, rows))
+        done = True
+    finally:
+        if all_fh is not None:
+            all_fh.close()
+            if done:
+                os.replace(all_tmp, all_path)
+            else:
+                os.remove(all_tmp)  # недописанный файл не должен выглядеть как результат
 
-    # если запускаем по нескольким странам — сохраняем общий CSV
     if len(countries) > 1:
-        write_csv("all_results.csv", all_rows)
-        print("Saved: all_results.csv")
+        print(f"Saved: {all_path}")
 
     print("\n✅ Done.")
 
@@ -17,14 +17,19 @@ niche_brand_audit.py
 """
 
 import argparse
+import csv
+import threading
 import time
 import re
-import unicodedata
-from typing import List, Dict, Any, Optional
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Iterator, Optional
 
-import pandas as pd
 import requests
-from google_play_scraper import search as gp_search
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from google_play_scraper import app as gp_app, search as gp_search
 from urllib.parse import urljoin
 
 # каталог стран/брендов
@@ -33,6 +38,8 @@ from brands_catalog import (
     get_country_title,
     get_country_language,
     canonical_list,
+    normalize_text,  # ASCII fast path + lru_cache: бренды и тайтлы повторяются
+    ascii_fold_words,
 )
 
 # Keyapp API
@@ -40,71 +47,203 @@ DEFAULT_BASE_URL = "https://keyapp.top/api/v2"
 DEFAULT_PATHS = {"apps": "/apps"}
 
 from pathlib import Path
-import json, hashlib, datetime as dt
+import json, hashlib, sqlite3, datetime as dt
+
+try:  # orjson опционален: быстрее, но без него всё работает на stdlib json
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    _loads = json.loads
 
 CACHE_DIR = Path(".cache")
-CACHE_DIR.mkdir(exist_ok=True)
-def _now(): return dt.datetime.utcnow()
 
-def _read_cache(name):
-    p = CACHE_DIR / f"{name}.json"
-    if p.exists():
-        try: return json.loads(p.read_text("utf-8"))
-        except: return {}
-    return {}
+# Кэш Play/AppstoreSpy — SQLite (WAL): одна строка на upsert вместо перезаписи всего JSON-файла.
+# Соединение общее для потоков, доступ сериализуем локом. Открывается лениво (_get_db):
+# импорт модуля не создаёт .cache/ и не трогает файлы пользователя.
+_cache_lock = threading.Lock()
+_cache_init_lock = threading.Lock()
+_cache_db: Optional[sqlite3.Connection] = None
+
+def _get_db() -> sqlite3.Connection:
+    """Соединение с кэшем; при первом вызове создаёт .cache/cache.db и переносит старые JSON-кэши."""
+    global _cache_db
+    if _cache_db is None:
+        with _cache_init_lock:
+            if _cache_db is None:
+                CACHE_DIR.mkdir(exist_ok=True)
+                db = sqlite3.connect(CACHE_DIR / "cache.db", isolation_level=None, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS cache(ns TEXT, k TEXT, ts REAL, data TEXT, PRIMARY KEY(ns, k))"
+                )
+                for ns in ("play_search", "aspy_meta"):
+                    _import_legacy_json_cache(db, ns)
+                _cache_db = db
+    return _cache_db
+
+def _ts_epoch(v: Any) -> float:
+    """ts записи -> epoch-секунды; старые записи хранят ISO-время (UTC), нераспознанное = протухшее."""
+    if isinstance(v, (int, float)):
+        return float(v)
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return dt.datetime.fromisoformat(v).replace(tzinfo=dt.timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def cache_get(ns: str, key: str) -> Optional[Dict[str, Any]]:
+    """{'ts': epoch-секунды, 'data': ...} или None, если записи нет/она битая."""
+    db = _get_db()
+    with _cache_lock:
+        row = db.execute("SELECT ts, data FROM cache WHERE ns=? AND k=?", (ns, key)).fetchone()
+    if row is None:
+        return None
+    try:
+        return {"ts": _ts_epoch(row[0]), "data": _loads(row[1])}
+    except ValueError:
+        return None
 
-def _write_cache(name, data):
-    (CACHE_DIR / f"{name}.json").write_text(json.dumps(data), encoding="utf-8")
+def cache_put(ns: str, key: str, data: Any) -> None:
+    db = _get_db()
+    with _cache_lock:
+        db.execute(
+            "INSERT OR REPLACE INTO cache(ns, k, ts, data) VALUES (?, ?, ?, ?)",
+            (ns, key, time.time(), _dumps(data)),
+        )
 
-# кэши:
-play_cache = _read_cache("play_search")
-aspy_cache = _read_cache("aspy_meta")
+def cache_delete(ns: str, key: str) -> None:
+    db = _get_db()
+    with _cache_lock:
+        db.execute("DELETE FROM cache WHERE ns=? AND k=?", (ns, key))
 
-def _expired(ts_iso: str, ttl_days: int) -> bool:
+def _import_legacy_json_cache(db: sqlite3.Connection, ns: str) -> None:
+    """Разово переносим старый .cache/<ns>.json в SQLite, чтобы не потерять накопленное."""
+    p = CACHE_DIR / f"{ns}.json"
+    if not p.exists():
+        return
     try:
-        ts = dt.datetime.fromisoformat(ts_iso)
-        return (_now() - ts).days >= ttl_days
-    except:
-        return True
+        legacy = _loads(p.read_bytes())
+    except Exception:
+        legacy = {}
+    rows = [
+        (ns, k, rec.get("ts", ""), _dumps(rec.get("data")))
+        for k, rec in (legacy.items() if isinstance(legacy, dict) else [])
+        if isinstance(rec, dict)
+    ]
+    # вызывается из _get_db до публикации соединения — других пользователей у db ещё нет
+    db.executemany("INSERT OR IGNORE INTO cache(ns, k, ts, data) VALUES (?, ?, ?, ?)", rows)
+    p.rename(p.with_name(p.name + ".migrated"))
+
+def _expired(ts: float, ttl_days: float) -> bool:
+    return time.time() - ts >= ttl_days * 86400
+
+class TokenBucket:
+    """Потокобезопасный token bucket: средний темп rate/сек, всплеск до burst запросов."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def _make_limiter(pause: float, workers: int) -> Optional[TokenBucket]:
+    # pause — прежняя пауза между запросами: общий темп 1/pause в секунду на все потоки,
+    # как при последовательном обходе; потоки лишь дают всплеск до workers и не спят после медленных ответов
+    if pause <= 0:
+        return None
+    return TokenBucket(rate=1 / pause, burst=max(1, workers))
 
-def play_search_cached(query, lang, cc, topn, ttl_days):
-    key = hashlib.md5(f"{query}|{lang}|{cc}|{topn}".encode()).hexdigest()
-    rec = play_cache.get(key)
-    if isinstance(rec, dict) and not _expired(rec.get("ts", ""), ttl_days):
-        data = rec.get("data")
+def play_search_cached(query, lang, cc, topn, ttl_days, limiter=None):
+    key = hashlib.blake2b(f"{query}|{lang}|{cc}|{topn}".encode(), digest_size=12).hexdigest()
+    rec = cache_get("play_search", key)
+    if rec is not None and not _expired(rec["ts"], ttl_days):
+        data = rec["data"]
         if isinstance(data, list) and data:
             return data
-        # пустые ответы ([], None) не кэшируем — мог быть сетевой сбой
-        play_cache.pop(key, None)
 
+    if limiter is not None:
+        limiter.acquire()
     data = play_search_candidates(query, lang, cc, topn)
     if data:
-        play_cache[key] = {"ts": _now().isoformat(), "data": data}
+        cache_put("play_search", key, data)
     else:
-        play_cache.pop(key, None)
-    _write_cache("play_search", play_cache)
+        # пустые ответы ([], None) не кэшируем — мог быть сетевой сбой
+        cache_delete("play_search", key)
     return data
 
-def aspy_enrich_cached(app_id, session, ttl_days):
-    rec = aspy_cache.get(app_id)
-    if isinstance(rec, dict) and not _expired(rec.get("ts", ""), ttl_days):
-        data = rec.get("data")
-        if isinstance(data, dict) and data:
-            return data
-        # некорректная запись — пересчитаем
-        aspy_cache.pop(app_id, None)
+def _is_negative(meta: Dict[str, Any]) -> bool:
+    return meta.get("daily") is None and meta.get("banned") is None
 
+def aspy_enrich_cached(app_id, session, ttl_days, negative_ttl_days=0.5, limiter=None):
+    rec = cache_get("aspy_meta", app_id)
+    if rec is not None:
+        data = rec["data"]
+        if isinstance(data, dict) and data:
+            # пустой ответ (404/сбой сети/лимит) живёт меньше, чтобы приложение перепроверилось
+            ttl = negative_ttl_days if _is_negative(data) else ttl_days
+            if not _expired(rec["ts"], ttl):
+                return data
+        # некорректная/протухшая запись — пересчитаем
+
+    if limiter is not None:
+        limiter.acquire()
     data = aspy_enrich(app_id, session)
     if data:
-        aspy_cache[app_id] = {"ts": _now().isoformat(), "data": data}
+        cache_put("aspy_meta", app_id, data)
     else:
-        aspy_cache.pop(app_id, None)
-    _write_cache("aspy_meta", aspy_cache)
+        cache_delete("aspy_meta", app_id)
     return data
 
 # AppstoreSpy API
 ASPY_BASE = "https://api.appstorespy.com/v1"
 
+class _CappedRetry(Retry):
+    """Retry с потолком на Retry-After: квотный 429 может попросить ждать часами, а поток держать нельзя."""
+
+    MAX_RETRY_AFTER = 5.0
+
+    def get_retry_after(self, response) -> Optional[float]:
+        v = super().get_retry_after(response)
+        return None if v is None else min(v, self.MAX_RETRY_AFTER)
+
+def _make_session(pool: int = 4, headers: Optional[Dict[str, str]] = None) -> requests.Session:
+    """Сессия с пулом keep-alive соединений и ретраями на 429/5xx (TLS-рукопожатие — один раз)."""
+    sess = requests.Session()
+    # POST /play/apps/query — чтение, повторять его так же безопасно, как GET
+    retry = _CappedRetry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                         allowed_methods=frozenset({"GET", "POST"}))
+    sess.mount("https://", HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=retry))
+    if headers:
+        sess.headers.update(headers)
+    return sess
+
+# общая сессия для Keyapp (заголовки авторизации передаются в каждом запросе)
+_KEYAPP_SESSION = _make_session()
+
 def _headers_keyapp(token: str) -> Dict[str,str]:
     return {"Authorization": f"Bearer {token}", "Accept": "application/json"}
 
@@ -112,18 +251,16 @@ def _headers_aspy(api_key: str) -> Dict[str,str]:
     """AppstoreSpy now expects the API key in the API-KEY header (see docs)."""
     return {"API-KEY": api_key, "Accept": "application/json"}
 
-def normalize_text(s: str) -> str:
-    s = (s or "").strip().lower()
-    s = ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
-    return re.sub(r'[^a-z0-9]+','',s)
+_TOK_RE = re.compile(r"[a-z0-9]+")
 
-import re, unicodedata
-
-def _normalize_tokens(s: str) -> list[str]:
+@lru_cache(maxsize=50000)
+def _normalize_tokens(s: str) -> tuple[str, ...]:
     s = (s or "").lower().strip()
-    s = ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
+    # не ascii_fold: прочий не-ASCII (•, –, ł, ß, кириллица) должен остаться разделителем слов,
+    # иначе «Betano•Sports» склеится в один токен
+    s = ascii_fold_words(s)
     # токены: буквы/цифры, длиной >= 3
-    return [t for t in re.findall(r"[a-z0-9]+", s) if len(t) >= 3]
+    return tuple(t for t in _TOK_RE.findall(s) if len(t) >= 3)
 
 def _extract_app_records(payload: Any) -> list[dict]:
     """Keyapp API может возвращать список приложений в разных обёртках — нормализуем."""
@@ -209,7 +346,7 @@ def keyapp_fetch_app_titles(base_url: str, token: str, *, per_page: int = 200, m
         visited.add(key)
 
         try:
-            resp = requests.get(url, headers=headers, params=params, timeout=30)
+            resp = _KEYAPP_SESSION.get(url, headers=headers, params=params, timeout=30)
             resp.raise_for_status()
             payload = resp.json()
         except Exception:
@@ -240,9 +377,14 @@ def keyapp_fetch_app_titles(base_url: str, token: str, *, per_page: int = 200, m
     return titles
 
 
-def build_keyapp_title_index(titles: List[str]) -> list[tuple[set[str], str]]:
-    index: list[tuple[set[str], str]] = []
+# (нормализованные названия целиком, токен -> битовая маска id названий, где он встречается)
+KeyappIndex = tuple[set[str], dict[str, int]]
+
+def build_keyapp_title_index(titles: List[str]) -> KeyappIndex:
+    norms: set[str] = set()
+    postings: dict[str, int] = defaultdict(int)
     seen: set[str] = set()
+    tid = 0
     for title in titles:
         if not title:
             continue
@@ -254,24 +396,35 @@ def build_keyapp_title_index(titles: List[str]) -> list[tuple[set[str], str]]:
         if key in seen:
             continue
         seen.add(key)
-        index.append((tokens, norm))
-    return index
+        if norm:
+            norms.add(norm)
+        bit = 1 << tid
+        for tok in tokens:
+            postings[tok] |= bit
+        tid += 1
+    return norms, dict(postings)
 
 
-def brand_used_in_titles(brand: str, titles_index: list[tuple[set[str], str]]) -> bool:
+def brand_used_in_titles(brand: str, titles_index: KeyappIndex) -> bool:
+    norms, postings = titles_index
     brand_norm = normalize_text(brand)
     b_tokens = _normalize_tokens(brand)
-    meaningful_tokens = [t for t in b_tokens if len(t) >= 4]
 
     if len(b_tokens) == 1 and len(b_tokens[0]) < 4 and not brand_norm:
         return False
 
-    for tokens, norm in titles_index:
-        if brand_norm and norm and brand_norm == norm:
-            return True
-        if meaningful_tokens and any(t in tokens for t in meaningful_tokens):
-            return True
-        if len(b_tokens) >= 2 and len(set(b_tokens).intersection(tokens)) >= 2:
+    if brand_norm and brand_norm in norms:
+        return True
+    if any(t in postings for t in b_tokens if len(t) >= 4):
+        return True
+    if len(b_tokens) >= 2:
+        # >= 2 разных токена бренда в одном и том же названии: бит, встреченный повторно
+        seen_bits = dup_bits = 0
+        for t in set(b_tokens):
+            m = postings.get(t, 0)
+            dup_bits |= seen_bits & m
+            seen_bits |= m
+        if dup_bits:
             return True
     return False
 
@@ -280,17 +433,19 @@ def brand_used_in_titles(brand: str, titles_index: list[tuple[set[str], str]]) -
 def play_search_candidates(keyword: str, lang: str, country_cc: str, topn: int, retries: int = 2, pause: float = 0.5) -> List[Dict[str, Any]]:
     out = []
     res = []
+    # повторяем только сбои: пустая выдача — валидный ответ, и повтор вернёт то же самое
+    # (gp_search ходит через urllib, а не requests — Retry на адаптер сюда не повесить)
     for attempt in range(1, retries+1):
         try:
             res = gp_search(keyword, n=topn, lang=lang, country=country_cc.upper())
+            break
         except Exception:
             time.sleep(pause * attempt)
-            try:
-                res = gp_search(keyword, n=topn)  # fallback без локали
-            except Exception:
-                res = []
-        if res:
-            break
+    else:
+        try:
+            res = gp_search(keyword, n=topn)  # fallback без локали
+        except Exception:
+            res = []
     for item in (res or []):
         app_id = item.get('appId')
         title = str(item.get('title','')).strip()
@@ -302,8 +457,36 @@ def play_search_candidates(keyword: str, lang: str, country_cc: str, topn: int,
             })
     return out
 
+_INSTALLS_DIGITS_RE = re.compile(r"\d+")
+
+def play_min_installs(app_id: str, lang: str, country_cc: str) -> Optional[int]:
+    """Нижняя граница установок из карточки Play («10,000,000+» -> 10000000), None при сбое."""
+    try:
+        info = gp_app(app_id, lang=lang, country=country_cc.upper())
+    except Exception:
+        return None
+    v = info.get("minInstalls")
+    if isinstance(v, int):
+        return v
+    digits = "".join(_INSTALLS_DIGITS_RE.findall(str(info.get("installs") or "")))
+    return int(digits) if digits else None
+
+def play_min_installs_cached(app_id, lang, cc, ttl_days, limiter=None):
+    key = f"{app_id}|{lang}|{cc}"
+    rec = cache_get("play_installs", key)
+    if rec is not None and not _expired(rec["ts"], ttl_days) and isinstance(rec["data"], int):
+        return rec["data"]
+    if limiter is not None:
+        limiter.acquire()
+    v = play_min_installs(app_id, lang, cc)
+    if v is not None:
+        cache_put("play_installs", key, v)
+    return v
+
 # ---------- AppstoreSpy helpers ----------
 
+_ASPY_GIVEUP = frozenset({401, 403, 404, 422})
+
 def _aspy_request(
     session: requests.Session,
     method: str,
@@ -320,59 +503,49 @@ def _aspy_request(
     except Exception:
         return {}
 
-    if r.status_code in {401, 403}:
-        # неверный ключ — смысла продолжать нет
-        return {}
-
-    if r.status_code in {404, 422}:
-        # нет данных по приложению — возвращаем пусто
-        return {}
-
-    if r.status_code == 429:
-        # превышение лимита — не стопорим пайплайн, просто отдаём пусто
-        return {}
-
-    if not r.ok:
+    # 401/403 — неверный ключ, 404/422 — нет данных по приложению, прочие не-2xx — сбой:
+    # во всех случаях отдаём пусто (429/5xx уже отретраены адаптером)
+    if r.status_code in _ASPY_GIVEUP or not r.ok:
         return {}
 
     try:
-        data = r.json()
+        data = _loads(r.content)
     except ValueError:
         return {}
 
     # Некоторые эндпоинты (installs_daily) возвращают список, остальные — dict
     return data or {}
 
+_DAILY_FLAT_KEYS = ("ipd", "downloads_daily", "installs_daily", "daily_installs",
+                    "est_installs_per_day", "installs_per_day")
+_DAILY_NESTED_KEYS = (("metrics", "daily_installs"), ("summary", "daily_installs"), ("downloads", "daily"))
+_SKIP = object()
+
+def _daily_value(v: Any) -> Any:
+    try:
+        return float(v)
+    except Exception:
+        try:
+            return float(v[-1]) if isinstance(v, list) and v else None
+        except Exception:
+            return _SKIP
+
 def _extract_daily_installs_any(data: Dict[str, Any]) -> Optional[float]:
-    # Пытаемся вынуть daily installs из разных возможных мест
-    candidates = [
-        ("ipd",),
-        ("downloads_daily",),
-        ("installs_daily",),
-        ("daily_installs",),
-        ("est_installs_per_day",),
-        ("installs_per_day",),
-        ("metrics","daily_installs"),
-        ("summary","daily_installs"),
-        ("downloads","daily"),
-    ]
-    for path in candidates:
-        node = data
-        ok = True
-        for k in path:
-            if isinstance(node, dict) and k in node:
-                node = node[k]
-            else:
-                ok = False
-                break
-        if ok and node is not None:
-            try:
-                return float(node)
-            except Exception:
-                try:
-                    return float(node[-1]) if isinstance(node, list) and node else None
-                except Exception:
-                    pass
+    # Пытаемся вынуть daily installs из разных возможных мест: сначала плоские ключи, потом вложенные
+    for k in _DAILY_FLAT_KEYS:
+        v = data.get(k)
+        if v is not None:
+            r = _daily_value(v)
+            if r is not _SKIP:
+                return r
+    for top, sub in _DAILY_NESTED_KEYS:
+        node = data.get(top)
+        if isinstance(node, dict):
+            v = node.get(sub)
+            if v is not None:
+                r = _daily_value(v)
+                if r is not _SKIP:
+                    return r
     return None
 
 def _extract_daily_series_any(data: Dict[str, Any]) -> List[float]:
@@ -449,6 +622,9 @@ def aspy_enrich(app_id: str, session: requests.Session) -> Dict[str, Any]:
         b = _extract_banned_flag(data)
         if b is not None:
             out["banned"] = bool(b)
+        # карточка дала всё, что нужно — остальные эндпоинты не трогаем
+        if out["daily"] is not None and out["banned"] is not None:
+            return out
 
     # 2) daily installs (по датам)
     if out["daily"] is None:
@@ -487,82 +663,121 @@ def aspy_enrich(app_id: str, session: requests.Session) -> Dict[str, Any]:
 
 # ---------- основной цикл по стране ----------
 
+AUDIT_FIELDS = [
+    "ключ", "конкурент", "конкурент_url", "конкурент_app_id", "Юзаный", "страна",
+    "инстайлы в день", "конкурент в бане", "конкуренты_инсталлы",
+]
+
+_BANNED_MARK = {True: "Да", False: "Нет"}
+
+def _fmt_daily(v: Any) -> Any:
+    return int(v) if isinstance(v, (int, float)) else "-"
+
 def audit_country_all_brands(
     country_code: str,
-    keyapp_titles_index: list[tuple[set[str], str]],
-    aspy_key: Optional[str],
+    keyapp_titles_index: KeyappIndex,
+    aspy_session: Optional[requests.Session],
     topn: int,
     play_sleep: float,
     aspy_sleep: float,
     cache_ttl_days: int = 3,
-) -> pd.DataFrame:
-    brands = canonical_list(country_code)
+    aspy_cache_ttl_days: Optional[float] = None,
+    aspy_negative_ttl_days: float = 0.5,
+    aspy_workers: int = 8,
+    play_workers: int = 8,
+    play_installs_fallback: bool = False,
+    enrich_topn: Optional[int] = None,
+) -> Iterator[tuple]:
+    # дубли по нормализованному виду («Bet-365» / «bet365») дали бы повторные запросы и строки
+    seen: set[str] = set()
+    brands = []
+    for kw in canonical_list(country_code):
+        k = normalize_text(kw)
+        if k and k not in seen:
+            seen.add(k)
+            brands.append(kw)
     lang = get_country_language(country_code)
     country_title = get_country_title(country_code)
 
-    sess = None
-    if aspy_key:
-        sess = requests.Session()
-        sess.headers.update(_headers_aspy(aspy_key))
-
-    rows = []
-    for kw in brands:
-        # 1) кандидаты из Google Play
-        candidates = play_search_cached(kw, lang, country_code, topn, cache_ttl_days)
-        time.sleep(play_sleep)
-
-        # 2) для каждого — тянем installs/day + banned
-        enriched = []
-        for c in candidates:
-            daily = None
-            banned = None
-            if sess is not None:
-                meta = aspy_enrich_cached(c["appId"], sess, cache_ttl_days)
-                daily = meta.get("daily")
-                banned = meta.get("banned")
-                time.sleep(aspy_sleep)
-            enriched.append({**c, "daily": daily, "banned": banned})
-
-        # 3) выбираем «жирного» по installs/day (если все None — первый)
-        top = None
-        if enriched:
-            non_null = [x for x in enriched if x["daily"] is not None]
-            top = (max(non_null, key=lambda x: x["daily"]) if non_null else enriched[0])
-
-        comp_title = top["title"] if top else ""
-        comp_url = top["url"] if top else ""
-        comp_daily = int(top["daily"]) if (top and isinstance(top["daily"], (int, float))) else ""
-        comp_banned = top.get("banned") if top else None
-        comp_banned = bool(comp_banned) if isinstance(comp_banned, bool) else None
-        comp_app_id = top.get("appId") if top else ""
-
-        # 4) сводка кандидатов: "Title::installs::banned"
-        bundle = "-"
-        if enriched:
-            parts = []
-            for ci in enriched:
-                di = (int(ci["daily"]) if isinstance(ci["daily"], (int, float)) else "-")
-                bn_flag = ci.get("banned")
-                if isinstance(bn_flag, bool):
-                    bn = "Да" if bn_flag else "Нет"
+    sess = aspy_session
+    # метаданные приложения стабильнее выдачи Play — TTL можно задать отдельно
+    aspy_ttl = cache_ttl_days if aspy_cache_ttl_days is None else aspy_cache_ttl_days
+
+    # лимит темпа тратится только на реальные запросы, попадания в кэш идут без ожидания
+    play_limiter = _make_limiter(play_sleep, play_workers)
+    aspy_limiter = _make_limiter(aspy_sleep, aspy_workers)
+
+    def _play(kw: str) -> List[Dict[str, Any]]:
+        return play_search_cached(kw, lang, country_code, topn, cache_ttl_days, play_limiter)
+
+    # 1) кандидаты из Google Play — сразу по всем брендам, параллельно
+    # (google_play_scraper синхронный, потоки отпускают GIL на сетевом ожидании)
+    with ThreadPoolExecutor(max_workers=max(1, play_workers)) as ex:
+        play_results = dict(zip(brands, ex.map(_play, brands)))
+
+    def _meta(app_id: str) -> Dict[str, Any]:
+        return aspy_enrich_cached(app_id, sess, aspy_ttl, aspy_negative_ttl_days, aspy_limiter)
+
+    def _installs(c: Dict[str, Any]) -> Optional[int]:
+        return play_min_installs_cached(c["appId"], lang, country_code, cache_ttl_days, play_limiter)
+
+    with ThreadPoolExecutor(max_workers=max(1, aspy_workers)) as pool:
+        # 2) installs/day + banned — одной волной по уникальным appId всех брендов страны:
+        # одно приложение часто всплывает у нескольких брендов, а лимитер держит общий темп
+        meta_by_app: Dict[str, Dict[str, Any]] = {}
+        if sess is not None:
+            # в AppstoreSpy идут только первые enrich_topn кандидатов по позиции в выдаче Play,
+            # хвост остаётся без данных («-»/«?» в сводке)
+            app_ids = list(dict.fromkeys(
+                c["appId"] for cands in play_results.values() for c in cands[:enrich_topn]
+            ))
+            meta_by_app = dict(zip(app_ids, pool.map(_meta, app_ids)))
+
+        for kw in brands:
+            enriched = []
+            for c in play_results[kw]:
+                meta = meta_by_app.get(c["appId"], {})
+                enriched.append({**c, "daily": meta.get("daily"), "banned": meta.get("banned")})
+
+            # 3) выбираем «жирного» по installs/day (если все None — первый)
+            top = None
+            if enriched:
+                non_null = [x for x in enriched if x["daily"] is not None]
+                if non_null:
+                    top = max(non_null, key=lambda x: x["daily"])
+                elif play_installs_fallback and len(enriched) > 1:
+                    # AppstoreSpy молчит — берём кандидата с наибольшими установками по карточке Play
+                    installs = list(pool.map(_installs, enriched))
+                    best = max(range(len(enriched)), key=lambda i: -1 if installs[i] is None else installs[i])
+                    top = enriched[best]
                 else:
-                    bn = "?"
-                parts.append(f"{ci['title']}::{di}::{bn}")
-            bundle = "; ".join(parts)
-
-        rows.append({
-            "ключ": kw,
-            "конкурент": comp_title,
-            "конкурент_url": comp_url,
-            "конкурент_app_id": comp_app_id,
-            "Юзаный": "Да" if brand_used_in_titles(kw, keyapp_titles_index) else "Нет",
-            "страна": country_title,
-            "инстайлы в день": comp_daily,
-            "конкурент в бане": ("Да" if comp_banned is True else "Нет" if comp_banned is False else ""),
-            "конкуренты_инсталлы": bundle
-        })
-
-    return pd.DataFrame(rows)
+                    top = enriched[0]
+
+            comp_title = top["title"] if top else ""
+            comp_url = top["url"] if top else ""
+            comp_daily = int(top["daily"]) if (top and isinstance(top["daily"], (int, float))) else ""
+            comp_banned = top.get("banned") if top else None
+            comp_banned = bool(comp_banned) if isinstance(comp_banned, bool) else None
+            comp_app_id = top.get("appId") if top else ""
+
+            # 4) сводка кандидатов: "Title::installs::banned"
+            bundle = "; ".join([
+                f"{ci['title']}::{_fmt_daily(ci['daily'])}::{_BANNED_MARK.get(ci.get('banned'), '?')}"
+                for ci in enriched
+            ]) or "-"
+
+            # порядок — как в AUDIT_FIELDS
+            yield (
+                kw,
+                comp_title,
+                comp_url,
+                comp_app_id,
+                "Да" if brand_used_in_titles(kw, keyapp_titles_index) else "Нет",
+                country_title,
+                comp_daily,
+                "Да" if comp_banned is True else "Нет" if comp_banned is False else "",
+                bundle,
+            )
 
 def main():
     ap = argparse.ArgumentParser(
@@ -572,36 +787,57 @@ def main():
     ap.add_argument("--base-url", default=DEFAULT_BASE_URL)
     ap.add_argument("--country", choices=get_supported_countries() + ["all"], default="all")
     ap.add_argument("--topn", type=int, default=10, help="Сколько результатов Play смотреть на бренд")
-    ap.add_argument("--play-sleep", type=float, default=0.2, help="Пауза между поисками Play (сек.)")
-    ap.add_argument("--aspy-sleep", type=float, default=0.15, help="Пауза между запросами AppstoreSpy (сек.)")
+    ap.add_argument("--play-sleep", type=float, default=0.2, help="Пауза между поисками Play (сек.): общий темп на все потоки")
+    ap.add_argument("--aspy-sleep", type=float, default=0.15, help="Пауза между запросами AppstoreSpy (сек.): общий темп на все потоки")
+    ap.add_argument("--aspy-workers", type=int, default=8, help="Параллельных запросов к AppstoreSpy")
+    ap.add_argument("--play-workers", type=int, default=8, help="Параллельных поисков в Google Play")
+    ap.add_argument("--enrich-topn", type=int, default=None,
+                    help="Обогащать через AppstoreSpy только первые N >= 1 кандидатов Play на бренд (по умолчанию все)")
+    ap.add_argument("--play-installs-fallback", action="store_true",
+                    help="Если AppstoreSpy не дал installs/day ни по одному кандидату — выбирать по установкам из карточки Play")
     ap.add_argument("--appstorespy-key", default=None, help="AppstoreSpy API key (Bearer)")
     ap.add_argument("--out", default="niche_competitors_keyapp.csv")
     ap.add_argument("--cache-ttl-days", type=int, default=3,
                     help="TTL кэша для AppstoreSpy/Play (дни)")
+    ap.add_argument("--aspy-cache-ttl-days", type=float, default=None,
+                    help="Отдельный TTL кэша AppstoreSpy (дни); по умолчанию = --cache-ttl-days")
+    ap.add_argument("--aspy-negative-ttl-days", type=float, default=0.5,
+                    help="TTL пустых ответов AppstoreSpy (дни)")
     args = ap.parse_args()
+    if args.enrich_topn is not None and args.enrich_topn < 1:
+        ap.error("--enrich-topn должен быть >= 1 (без флага обогащаются все кандидаты)")
 
     titles = keyapp_fetch_app_titles(args.base_url, args.api_key)
     keyapp_index = build_keyapp_title_index(titles)
     countries = get_supported_countries() if args.country == "all" else [args.country]
 
-    frames = []
-    for cc in countries:
-        frames.append(
-            audit_country_all_brands(
-                country_code=cc,
-                keyapp_titles_index=keyapp_index,
-                aspy_key=args.appstorespy_key,
-                topn=args.topn,
-                play_sleep=args.play_sleep,
-                aspy_sleep=args.aspy_sleep,
-                cache_ttl_days=args.cache_ttl_days,
+    # одна сессия AppstoreSpy на весь прогон: пул соединений переживает смену страны
+    aspy_session = None
+    if args.appstorespy_key:
+        aspy_session = _make_session(pool=max(1, args.aspy_workers), headers=_headers_aspy(args.appstorespy_key))
+
+    # строки пишем потоково, по мере готовности каждой страны
+    with open(args.out, "w", newline="", encoding="utf-8-sig") as fh:
+        writer = csv.writer(fh, lineterminator="\n")
+        writer.writerow(AUDIT_FIELDS)
+        for cc in countries:
+            writer.writerows(
+                audit_country_all_brands(
+                    country_code=cc,
+                    keyapp_titles_index=keyapp_index,
+                    aspy_session=aspy_session,
+                    topn=args.topn,
+                    play_sleep=args.play_sleep,
+                    aspy_sleep=args.aspy_sleep,
+                    cache_ttl_days=args.cache_ttl_days,
+                    aspy_cache_ttl_days=args.aspy_cache_ttl_days,
+                    aspy_negative_ttl_days=args.aspy_negative_ttl_days,
+                    aspy_workers=args.aspy_workers,
+                    play_workers=args.play_workers,
+                    play_installs_fallback=args.play_installs_fallback,
+                    enrich_topn=args.enrich_topn,
+                )
             )
-        )
-
-    final = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
-        columns=["ключ","конкурент","Юзаный","страна","installs_daily","конкурент_забанен","конкуренты_инсталлы"]
-    )
-    final.to_csv(args.out, index=False, encoding='utf-8-sig')
     print(f"Saved: {args.out}")
 
 if __name__ == "__main__":
@@ -2,15 +2,16 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import os
 from typing import List, Tuple, Optional
+import numpy as np
 import pandas as pd
-import unicodedata
 import re
 
 from brands_catalog import (
     get_supported_countries,
     get_country_title,
-    canonicalize,
+    get_reverse_index,
 )
 
 OUTPUT_COLUMNS = [
@@ -23,32 +24,70 @@ OUTPUT_COLUMNS = [
     "объем запросов",
 ]
 
+# текстовые колонки аудита читаем как строки, малокардинальные — категориями
+_AUDIT_DTYPES = {
+    "ключ": str,
+    "конкурент": str,
+    "конкурент_url": str,
+    "конкурент_app_id": str,
+    "конкуренты_инсталлы": str,
+    "страна": "category",
+    "Юзаный": "category",
+}
+
+# название страны в аудите → код (для канона в режиме нескольких стран)
+_TITLE2CC = {get_country_title(cc): cc for cc in get_supported_countries()}
+
+_BAN_YES = ("да", "true", "1")
+_BAN_NO = ("нет", "false", "0")
+
 # -------------------- helpers --------------------
 
-def _norm_basic(s: str) -> str:
-    """Простая нормализация: lower, снятие диакритики, оставляем только a-z0-9."""
-    s = (str(s) if s is not None else "").strip().lower()
-    s = "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
-    return re.sub(r"[^a-z0-9]+", "", s)
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+def _norm_basic_series(s: pd.Series) -> pd.Series:
+    """
+    Нормализация колонки: lower, снятие диакритики (NFKD + ASCII), оставляем только a-z0-9.
+    Ключи сильно повторяются (варианты, несколько файлов) — нормализуем только уникальные.
+    """
+    # пустые ячейки — пустая строка (а не «nan», как дал бы astype(str))
+    codes, uniques = pd.factorize(s.fillna("").astype(str))
+    u = pd.Series(uniques, dtype=str).str.strip().str.lower()
+    # для ASCII-ключей (их большинство) NFKD+encode — тождество; диакритику снимаем только у остальных
+    nonascii = ~u.map(str.isascii).to_numpy(dtype=bool)
+    if nonascii.any():
+        u[nonascii] = u[nonascii].str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+    u = u.str.replace(_NON_ALNUM_RE, "", regex=True)
+    return pd.Series(u.to_numpy()[codes], index=s.index, dtype=str)
 
 def _results_path(cc: str) -> str:
     """Путь к CSV объёмов по стране (совместим с br_results.csv / pl_results.csv)."""
     return f"{cc.lower()}_results.csv"
 
-def _canon(country_code: Optional[str], s: str) -> str:
-    """Берём канон из каталога, иначе нормализацию."""
-    if country_code:
+def _canon_series(keys: pd.Series, country_codes) -> pd.Series:
+    """
+    Канон для колонки ключей: нормализуем целиком, канон берём из reverse-index страны
+    (dict -> Series.map), иначе остаётся нормализация.
+    country_codes — код страны или Series кодов по строкам (None/NaN — без каталога).
+    """
+    norm = _norm_basic_series(keys)
+    if isinstance(country_codes, str) or country_codes is None:
+        country_codes = pd.Series(country_codes, index=keys.index, dtype=object)
+    canon = norm.copy()
+    for cc in country_codes.dropna().unique():
         try:
-            c = canonicalize(country_code, s)
-            if c:
-                return c
+            rev = get_reverse_index(cc)
         except KeyError:
-            # если страна вне каталога, падаем в нормализацию
-            pass
-    return _norm_basic(s)
+            # если страна вне каталога, остаётся нормализация
+            continue
+        m = country_codes.eq(cc)
+        canon[m] = norm[m].map(rev).fillna(norm[m])
+    return canon
 
 # -------------------- volumes --------------------
 
+_VOLUME_COLUMNS = frozenset({"keyword", "volume", "search_volume"})
+
 def load_volumes(path_country: List[Tuple[str, str]]) -> pd.DataFrame:
     """
     Загружает несколько файлов объёмов, строит 'canon' и берёт максимум объёма по канону.
@@ -57,7 +96,8 @@ def load_volumes(path_country: List[Tuple[str, str]]) -> pd.DataFrame:
     dfs = []
     for p, cc in path_country:
         try:
-            df = pd.read_csv(p)
+            # из results-файла нужны только ключ и объём — остальные колонки не парсим
+            df = pd.read_csv(p, usecols=lambda c: c in _VOLUME_COLUMNS, dtype={"keyword": str})
         except FileNotFoundError:
             continue
 
@@ -65,55 +105,36 @@ def load_volumes(path_country: List[Tuple[str, str]]) -> pd.DataFrame:
             continue
 
         # coalesce volume столбца
-        if "volume" in df.columns and "search_volume" not in df.columns:
-            df["search_volume"] = pd.to_numeric(df["volume"], errors="coerce")
-        else:
-            df["search_volume"] = pd.to_numeric(df.get("search_volume"), errors="coerce")
-        df["search_volume"] = df["search_volume"].fillna(0)
+        src = "volume" if "volume" in df.columns and "search_volume" not in df.columns else "search_volume"
+        # coerce + NaN→0 одним проходом прямо в numpy-буфер
+        df["search_volume"] = pd.to_numeric(df.get(src), errors="coerce").to_numpy(
+            dtype="float64", na_value=0.0
+        )
 
         # ключ → canon
-        df["keyword"] = df["keyword"].astype(str).str.strip()
-        df["canon"] = df["keyword"].apply(lambda x: _canon(cc, x))
+        df["keyword"] = df["keyword"].fillna("").astype(str).str.strip()
+        df["canon"] = _canon_series(df["keyword"], cc)
         dfs.append(df[["canon", "search_volume"]])
 
     if not dfs:
         return pd.DataFrame(columns=["canon", "search_volume"])
 
     vol = pd.concat(dfs, ignore_index=True)
-    vol = vol.groupby("canon", as_index=False)["search_volume"].max()
+    # группируем по int-кодам категорий; порядок групп не важен — дальше только lookup по канону
+    vol["canon"] = vol["canon"].astype("category")
+    vol = vol.groupby("canon", as_index=False, sort=False, observed=True)["search_volume"].max()
     return vol
 
-# -------------------- main --------------------
-
-def main():
-    ap = argparse.ArgumentParser(
-        description="Merge volumes with Keyapp audit (canonical join) + caps/filters/sorting"
-    )
-    ap.add_argument("--audit", default="niche_competitors_keyapp.csv",
-                    help="CSV из niche_brand_audit.py")
-    ap.add_argument("--country", choices=get_supported_countries() + ["all"], default="all")
-    # капы
-    ap.add_argument("--cap", type=int, default=None,
-                    help="Upper cap (если указан, экранирует cap-upper)")
-    ap.add_argument("--cap-upper", type=int, default=None,
-                    help="Upper cap (если cap не указан)")
-    ap.add_argument("--cap-lower", type=int, default=None,
-                    help="Lower cap (минимальный объём)")
-    # фильтры
-    ap.add_argument("--only-with-competitor", action="store_true",
-                    help="Оставлять только строки с конкурентом (конкурент != '-')")
-    ap.add_argument("--only-nonused", action="store_true",
-                    help="Оставлять только строки, где Юзаный == 'Нет'")
-    # сортировки
-    ap.add_argument("--sort", choices=["desc", "asc"], default="desc")
-    ap.add_argument("--sort-by", choices=["volume", "country"], default="volume")
-    ap.add_argument("--top-per-country", type=int, default=None,
-                    help="Оставить топ-N на страну после сортировки")
-    ap.add_argument("--out", default="niche_competitors_keyapp_sorted.csv")
-    args = ap.parse_args()
+# -------------------- ranking --------------------
 
+def prepare(audit_path: str, country: str = "all") -> Tuple[Optional[pd.DataFrame], str]:
+    """
+    Читает аудит и объёмы выбранных стран, считает canon и search_volume, чистит колонки.
+    Результат не зависит от капов/фильтров — его можно ранжировать много раз через rank().
+    Возвращает (df, "") или (None, причина), если ранжировать нечего.
+    """
     # какие страны используем
-    countries = get_supported_countries() if args.country == "all" else [args.country]
+    countries = get_supported_countries() if country == "all" else [country]
 
     # загрузим объёмы для выбранных стран
     vol_paths = [(_results_path(cc), cc) for cc in countries]
@@ -122,11 +143,9 @@ def main():
     country_for_canon = countries[0] if single_country else None
 
     # аудит
-    audit = pd.read_csv(args.audit)
+    audit = pd.read_csv(audit_path, dtype=_AUDIT_DTYPES)
     if audit.empty:
-        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(args.out, index=False, encoding="utf-8-sig")
-        print(f"Saved: {args.out} (empty audit)")
-        return
+        return None, "empty audit"
 
     rename_map = {}
     if "installs_daily" in audit.columns and "инстайлы в день" not in audit.columns:
@@ -140,93 +159,199 @@ def main():
     if "конкурент" not in audit.columns and "конкурент_url" in audit.columns:
         audit = audit.rename(columns={"конкурент_url": "конкурент"})
 
-    if "конкурент" in audit.columns and "конкурент_url" in audit.columns:
-        audit["конкурент"] = audit["конкурент"].fillna("")
-        audit["конкурент_url"] = audit["конкурент_url"].fillna("")
-        mask_empty = audit["конкурент"].astype(str).str.strip().eq("")
-        audit.loc[mask_empty, "конкурент"] = audit.loc[mask_empty, "конкурент_url"]
-
     # ограничим страны из аудита теми, что выбраны
     include_titles = {get_country_title(cc) for cc in countries}
     audit = audit[audit["страна"].isin(include_titles)].copy()
     if audit.empty:
-        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(args.out, index=False, encoding="utf-8-sig")
-        print(f"Saved: {args.out} (no rows for selected country)")
-        return
+        return None, "no rows for selected country"
 
     # посчитаем canon для аудита
     if country_for_canon is not None:
         # одна страна — канон по её правилам
-        audit["canon"] = audit["ключ"].apply(lambda x: _canon(country_for_canon, x))
+        audit["canon"] = _canon_series(audit["ключ"], country_for_canon)
     else:
-        # несколько стран — канон отдельно по каждой строке в зависимости от страны
-        title2cc = {get_country_title(cc): cc for cc in get_supported_countries()}
-        audit["canon"] = audit.apply(
-            lambda r: _canon(title2cc.get(r["страна"]), r["ключ"]), axis=1
-        )
+        # несколько стран — канон по стране строки; «страна» категориальная, map идёт по категориям
+        audit["canon"] = _canon_series(audit["ключ"], audit["страна"].map(_TITLE2CC))
 
     # загрузка объёмов и мердж
     vol = load_volumes(vol_paths)
 
-    merged = audit.merge(vol, on="canon", how="left")
-    merged["search_volume"] = pd.to_numeric(merged.get("search_volume"), errors="coerce").fillna(0)
+    # canon в vol уникален (max по канону) — left join сводится к словарному lookup
+    vol_map = dict(zip(vol["canon"], vol["search_volume"]))
+    merged = audit
+    merged["search_volume"] = merged["canon"].map(vol_map).fillna(0)
 
     if "инстайлы в день" in merged.columns:
-        merged["инстайлы в день"] = pd.to_numeric(merged["инстайлы в день"], errors="coerce")
-        merged["инстайлы в день"] = merged["инстайлы в день"].round().astype("Int64")
+        # пропуски остаются <NA> (пустая ячейка в выдаче), поэтому без fillna
+        merged["инстайлы в день"] = (
+            pd.to_numeric(merged["инстайлы в день"], errors="coerce").round().astype("Int64")
+        )
 
     if "конкурент в бане" in merged.columns:
-        merged["конкурент в бане"] = merged["конкурент в бане"].map(
-            lambda v: "Да" if str(v).strip().lower() in {"да", "true", "1"}
-            else ("Нет" if str(v).strip().lower() in {"нет", "false", "0"} else "")
+        ban = merged["конкурент в бане"].astype(str).str.strip().str.lower()
+        merged["конкурент в бане"] = np.select(
+            [ban.isin(_BAN_YES).to_numpy(), ban.isin(_BAN_NO).to_numpy()], ["Да", "Нет"], default=""
         )
 
-    # базовые фильтры
-    if args.only_nonused:
-        merged = merged[merged["Юзаный"].astype(str).str.strip().str.lower().eq("нет")].copy()
+    if "конкурент" in merged.columns:
+        # один проход strip; пустой конкурент подменяем URL — rank() дальше сравнивает с "" без обработки
+        comp = merged["конкурент"].fillna("").astype(str).str.strip()
+        if "конкурент_url" in merged.columns:
+            url = merged["конкурент_url"].fillna("").astype(str).str.strip()
+            comp = comp.where(comp.ne(""), url)
+        merged["конкурент"] = comp
+
+    return merged, ""
+
+def sort_frame(df: pd.DataFrame, sort: str = "desc", sort_by: str = "volume") -> pd.DataFrame:
+    """Сортировка выдачи. Стабильная: при равном объёме порядок строк аудита сохраняется."""
+    if sort_by == "volume":
+        return df.sort_values("search_volume", ascending=(sort == "asc"), kind="stable")
+    return df.sort_values(
+        ["страна", "search_volume"], ascending=[True, (sort == "asc")], kind="stable"
+    )
 
+def rank(
+    merged: pd.DataFrame,
+    *,
+    cap_upper: Optional[int] = None,
+    cap_lower: Optional[int] = None,
+    only_with_competitor: bool = False,
+    only_nonused: bool = False,
+    sort: str = "desc",
+    sort_by: str = "volume",
+    top_per_country: Optional[int] = None,
+    presorted: bool = False,
+) -> pd.DataFrame:
+    """
+    Фильтры/капы/сортировка поверх prepare(); входной df не меняется. Возвращает OUTPUT_COLUMNS.
+    presorted=True — merged уже отсортирован через sort_frame() с теми же sort/sort_by.
+    """
+    # фильтры — одна булева маска и один срез вместо копии на каждый шаг
     if "конкурент" in merged.columns:
-        competitor_series = merged["конкурент"].fillna("").astype(str).str.strip()
-        merged["конкурент"] = competitor_series
+        has_comp = merged["конкурент"].to_numpy() != ""
     else:
-        competitor_series = pd.Series([""] * len(merged), index=merged.index)
-    has_comp = competitor_series != ""
+        has_comp = np.zeros(len(merged), dtype=bool)
+
+    mask = np.ones(len(merged), dtype=bool)
+    if only_nonused:
+        used = merged["Юзаный"]
+        if isinstance(used.dtype, pd.CategoricalDtype):
+            # нормализуем только категории (их единицы), а не каждую строку
+            cats = used.cat.categories
+            mask &= used.isin(cats[cats.astype(str).str.strip().str.lower() == "нет"]).to_numpy()
+        else:
+            mask &= used.astype(str).str.strip().str.lower().eq("нет").to_numpy()
 
-    cap_upper = args.cap if args.cap is not None else args.cap_upper
+    volume = merged["search_volume"].to_numpy()
     if cap_upper is not None:
-        merged = merged[has_comp | (merged["search_volume"] <= cap_upper)].copy()
-    if args.cap_lower is not None:
-        merged = merged[has_comp | (merged["search_volume"] >= args.cap_lower)].copy()
-    if args.only_with_competitor:
-        merged = merged[has_comp].copy()
-
-    # сортировка
-    if args.sort_by == "volume":
-        merged = merged.sort_values("search_volume", ascending=(args.sort == "asc"))
-    else:
-        merged = merged.sort_values(
-            ["страна", "search_volume"], ascending=[True, (args.sort == "asc")]
-        )
+        mask &= has_comp | (volume <= cap_upper)
+    if cap_lower is not None:
+        mask &= has_comp | (volume >= cap_lower)
+    if only_with_competitor:
+        mask &= has_comp
+    out = merged[mask]
+
+    # срез отсортированного df сохраняет порядок — пересортировка не нужна
+    if not presorted:
+        out = sort_frame(out, sort=sort, sort_by=sort_by)
 
     # топ-N на страну (опционально)
-    if args.top_per_country:
-        merged = (
-            merged.groupby("страна", as_index=False, group_keys=False)
-            .apply(lambda d: d.head(args.top_per_country))
-        )
+    if top_per_country:
+        # head() на groupby сохраняет порядок строк после сортировки и колонку «страна»
+        out = out.groupby("страна", sort=False).head(top_per_country)
 
-    merged["объем запросов"] = merged["search_volume"].round().astype("Int64")
+    # sort_values/head вернули новый df — колонки пишем в него, а не в merged
+    out["объем запросов"] = out["search_volume"].round().astype("Int64")
 
     # гарантируем наличие колонок
     for col in OUTPUT_COLUMNS:
-        if col not in merged.columns:
+        if col not in out.columns:
             if col in {"объем запросов", "инстайлы в день"}:
-                merged[col] = pd.Series([pd.NA] * len(merged), dtype="Int64")
+                out[col] = pd.Series([pd.NA] * len(out), dtype="Int64", index=out.index)
             else:
-                merged[col] = ""
+                out[col] = ""
+
+    return out[OUTPUT_COLUMNS]
 
-    merged[OUTPUT_COLUMNS].to_csv(args.out, index=False, encoding="utf-8-sig")
-    print(f"Saved: {args.out}")
+def run(
+    audit_path: str,
+    outputs: List[Tuple[Optional[int], str]],
+    country: str = "all",
+    **filters,
+) -> None:
+    """
+    In-process API (его зовёт run_pipeline): аудит и объёмы готовятся и сортируются один раз,
+    затем на каждую пару (cap_upper, out) — срез через rank() и запись CSV.
+    filters — именованные параметры rank(), кроме cap_upper/presorted.
+    """
+    base, note = prepare(audit_path, country)
+    if base is not None:
+        base = sort_frame(base, sort=filters.get("sort", "desc"), sort_by=filters.get("sort_by", "volume"))
+        filters["presorted"] = True
+    for cap_upper, out in outputs:
+        if base is None:
+            pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(out, index=False, encoding="utf-8-sig")
+            print(f"Saved: {out} ({note})")
+            continue
+        rank(base, cap_upper=cap_upper, **filters).to_csv(out, index=False, encoding="utf-8-sig")
+        print(f"Saved: {out}")
+
+# -------------------- main --------------------
+
+def _parse_caps(s: str) -> List[int]:
+    try:
+        return [int(x) for x in s.split(",") if x.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"caps: ожидается список целых через запятую, получено {s!r}")
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Merge volumes with Keyapp audit (canonical join) + caps/filters/sorting"
+    )
+    ap.add_argument("--audit", default="niche_competitors_keyapp.csv",
+                    help="CSV из niche_brand_audit.py")
+    ap.add_argument("--country", choices=get_supported_countries() + ["all"], default="all")
+    # капы
+    ap.add_argument("--cap", type=int, default=None,
+                    help="Upper cap (если указан, экранирует cap-upper)")
+    ap.add_argument("--cap-upper", type=int, default=None,
+                    help="Upper cap (если cap не указан)")
+    ap.add_argument("--caps", type=_parse_caps, default=None,
+                    help="Пакет капов через запятую (500000,100000,...): один проход, файл на кап; "
+                         "имена — --out с суффиксом _cap<N>")
+    ap.add_argument("--cap-lower", type=int, default=None,
+                    help="Lower cap (минимальный объём)")
+    # фильтры
+    ap.add_argument("--only-with-competitor", action="store_true",
+                    help="Оставлять только строки с конкурентом (конкурент != '-')")
+    ap.add_argument("--only-nonused", action="store_true",
+                    help="Оставлять только строки, где Юзаный == 'Нет'")
+    # сортировки
+    ap.add_argument("--sort", choices=["desc", "asc"], default="desc")
+    ap.add_argument("--sort-by", choices=["volume", "country"], default="volume")
+    ap.add_argument("--top-per-country", type=int, default=None,
+                    help="Оставить топ-N на страну после сортировки")
+    ap.add_argument("--out", default="niche_competitors_keyapp_sorted.csv")
+    args = ap.parse_args()
+
+    if args.caps:
+        root, ext = os.path.splitext(args.out)
+        outputs = [(cap, f"{root}_cap{cap}{ext}") for cap in args.caps]
+    else:
+        cap_upper = args.cap if args.cap is not None else args.cap_upper
+        outputs = [(cap_upper, args.out)]
+    run(
+        args.audit,
+        outputs,
+        country=args.country,
+        cap_lower=args.cap_lower,
+        only_with_competitor=args.only_with_competitor,
+        only_nonused=args.only_nonused,
+        sort=args.sort,
+        sort_by=args.sort_by,
+        top_per_country=args.top_per_country,
+    )
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,7 @@ import argparse, json, os, subprocess, sys
 from pathlib import Path
 
 from brands_catalog import get_supported_countries
+import rank_competitors
 
 DEFAULT_CONFIG_PATH = Path.home() / ".config" / "keyword_pipeline" / "keys.json"
 
@@ -87,12 +88,18 @@ def main():
     p.add_argument("--fetch-retries", type=int, default=5)
     p.add_argument("--fetch-backoff", type=float, default=1.5)
     p.add_argument("--fetch-timeout", type=int, default=60)
+    p.add_argument("--fetch-workers", type=int, default=4)
+    p.add_argument("--fetch-no-cache", action="store_true")
 
     # audit (ALL бренды; topN Play; AppstoreSpy)
     p.add_argument("--keyapp-base-url", default="https://keyapp.top/api/v2")
     p.add_argument("--audit-topn", type=int, default=10)
     p.add_argument("--audit-play-sleep", type=float, default=0.2)
     p.add_argument("--audit-aspy-sleep", type=float, default=0.15)
+    p.add_argument("--audit-aspy-workers", type=int, default=8)
+    p.add_argument("--audit-play-workers", type=int, default=8)
+    p.add_argument("--audit-play-installs-fallback", action="store_true")
+    p.add_argument("--audit-enrich-topn", type=int, default=None)
 
     # rank
     p.add_argument("--cap-lower", type=int, default=None)
@@ -104,7 +111,8 @@ def main():
     # скрипты
     p.add_argument("--fetch-script", default="keywordtool_fetch.py")
     p.add_argument("--audit-script", default="niche_brand_audit.py")
-    p.add_argument("--rank-script",  default="rank_competitors.py")
+    p.add_argument("--rank-script",  default=None,
+                   help="(устарело, игнорируется) ранжирование идёт in-process через rank_competitors.run")
 
     p.add_argument("--only-nonused", action="store_true",
                    help="(устарело) Явно оставить только неюзанные бренды")
@@ -112,6 +120,11 @@ def main():
                    help="Не фильтровать бренды, которые уже есть в Keyapp (по умолчанию скрываем их)")
 
     args = p.parse_args()
+    if args.audit_enrich_topn is not None and args.audit_enrich_topn < 1:
+        p.error("--audit-enrich-topn должен быть >= 1 (без флага обогащаются все кандидаты)")
+    if args.rank_script is not None:
+        print(f"⚠️  --rank-script {args.rank_script} игнорируется: ранжирование идёт in-process "
+              "через rank_competitors.run", file=sys.stderr)
     cwd = Path.cwd()
     cfg = Path(args.config) if args.config else None
 
@@ -147,9 +160,11 @@ def main():
         "--retries", str(args.fetch_retries),
         "--backoff", str(args.fetch_backoff),
         "--timeout", str(args.fetch_timeout),
+        "--workers", str(args.fetch_workers),
     ]
     if args.no_variants: fetch_cmd.append("--no-variants")
     if args.skip_health: fetch_cmd.append("--skip-health")
+    if args.fetch_no_cache: fetch_cmd.append("--no-cache")
     run(fetch_cmd, cwd)
 
     # 1) audit (ALL бренды; конкурент = max installs/day; banned-флаг)
@@ -162,64 +177,45 @@ def main():
         "--topn", str(args.audit_topn),
         "--play-sleep", str(args.audit_play_sleep),
         "--aspy-sleep", str(args.audit_aspy_sleep),
+        "--aspy-workers", str(args.audit_aspy_workers),
+        "--play-workers", str(args.audit_play_workers),
         "--out", audit_out,
     ]
     if aspy:
         audit_cmd += ["--appstorespy-key", aspy]
+    if args.audit_play_installs_fallback:
+        audit_cmd.append("--play-installs-fallback")
+    if args.audit_enrich_topn is not None:
+        audit_cmd += ["--enrich-topn", str(args.audit_enrich_topn)]
     run(audit_cmd, cwd)
 
-    # 2) rank — пакет капов
+    # 2) rank — пакет капов, in-process: аудит и объёмы читаются один раз на все капы
     caps = str2caps(args.caps)
     filter_nonused = True
     if getattr(args, "include_used", False):
         filter_nonused = False
     if getattr(args, "only_nonused", False):
         filter_nonused = True
-    if not caps:
-        out_file = outname(args.country, None, args.rank_out)
-        rank_cmd = [
-            sys.executable, args.rank_script,
-            "--audit", audit_out,
-            "--country", args.country,
-            "--sort", args.sort,
-            "--sort-by", args.sort_by,
-            "--out", out_file,
-        ]
-        if args.cap_lower is not None:
-            rank_cmd += ["--cap-lower", str(args.cap_lower)]
-        if args.only_with_competitor:
-            rank_cmd.append("--only-with-competitor")
-        if filter_nonused:
-            rank_cmd.append("--only-nonused")
-        if args.top_per_country is not None:
-            rank_cmd += ["--top-per-country", str(args.top_per_country)]
-        run(rank_cmd, cwd)
-        print(f"\n✅ Pipeline done. Output: {out_file}")
-        return
+    outputs = [(cap, outname(args.country, cap, args.rank_out)) for cap in caps] or \
+        [(None, outname(args.country, None, args.rank_out))]
+    print(f"\n$ rank_competitors.run --audit {audit_out} --country {args.country}"
+          f" --caps {','.join(str(c) for c in caps) or '-'}")
+    rank_competitors.run(
+        audit_out,
+        outputs,
+        country=args.country,
+        cap_lower=args.cap_lower,
+        only_with_competitor=args.only_with_competitor,
+        only_nonused=filter_nonused,
+        sort=args.sort,
+        sort_by=args.sort_by,
+        top_per_country=args.top_per_country,
+    )
 
-    for cap in caps:
-        out_file = outname(args.country, cap, args.rank_out)
-        rank_cmd = [
-            sys.executable, args.rank_script,
-            "--audit", audit_out,
-            "--country", args.country,
-            "--sort", args.sort,
-            "--sort-by", args.sort_by,
-            "--out", out_file,
-            "--cap", str(cap),
-        ]
-        if args.cap_lower is not None:
-            rank_cmd += ["--cap-lower", str(args.cap_lower)]
-        if args.only_with_competitor:
-            rank_cmd.append("--only-with-competitor")
-        if filter_nonused:
-            rank_cmd.append("--only-nonused")
-        if args.top_per_country is not None:
-            rank_cmd += ["--top-per-country", str(args.top_per_country)]
-        run(rank_cmd, cwd)
-        print(f"   ↳ wrote: {out_file}")
-
-    print("\n✅ Batch pipeline done.")
+    if not caps:
+        print(f"\n✅ Pipeline done. Output: {outputs[0][1]}")
+    else:
+        print("\n✅ Batch pipeline done.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import niche_brand_audit as nba
+
+
+class AuditCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        patches = [
+            mock.patch.object(nba, "CACHE_DIR", Path(self._tmp.name) / ".cache"),
+            mock.patch.object(nba, "_cache_db", None),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        if nba._cache_db is not None:
+            nba._cache_db.close()
+        self._tmp.cleanup()
+
+    def _age(self, ns, key, days):
+        """Сдвигаем ts записи в прошлое на days суток."""
+        with nba._cache_lock:
+            nba._get_db().execute(
+                "UPDATE cache SET ts=? WHERE ns=? AND k=?", (time.time() - days * 86400, ns, key)
+            )
+
+    def test_import_has_no_side_effects(self):
+        # свежий интерпретатор в пустой папке: импорт не создаёт .cache/
+        with tempfile.TemporaryDirectory() as d:
+            subprocess.run([sys.executable, "-c", "import niche_brand_audit"],
+                           cwd=d, env={**os.environ, "PYTHONPATH": ROOT}, check=True)
+            self.assertEqual(os.listdir(d), [])
+
+    def test_put_get_delete(self):
+        self.assertIsNone(nba.cache_get("play_search", "k"))
+        nba.cache_put("play_search", "k", [{"appId": "a"}])
+        rec = nba.cache_get("play_search", "k")
+        self.assertEqual(rec["data"], [{"appId": "a"}])
+        self.assertFalse(nba._expired(rec["ts"], 1))
+        nba.cache_delete("play_search", "k")
+        self.assertIsNone(nba.cache_get("play_search", "k"))
+
+    def test_legacy_iso_ts_and_migration(self):
+        nba.CACHE_DIR.mkdir()
+        (nba.CACHE_DIR / "aspy_meta.json").write_text(
+            '{"a": {"ts": "2020-01-01T00:00:00", "data": {"daily": 5}}}', encoding="utf-8"
+        )
+        rec = nba.cache_get("aspy_meta", "a")
+        self.assertEqual(rec["data"], {"daily": 5})
+        self.assertTrue(nba._expired(rec["ts"], 3))
+        self.assertTrue((nba.CACHE_DIR / "aspy_meta.json.migrated").exists())
+
+    def test_aspy_ttl_and_negative_ttl(self):
+        positive = {"daily": 120, "banned": False}
+        negative = {"daily": None, "banned": None}
+        answers = {"pos": positive, "neg": negative}
+        with mock.patch.object(nba, "aspy_enrich", side_effect=lambda app_id, s: answers[app_id]) as m:
+            for app_id in ("pos", "neg"):
+                nba.aspy_enrich_cached(app_id, None, ttl_days=3, negative_ttl_days=0.5)
+            self.assertEqual(m.call_count, 2)
+
+            # через сутки: позитив ещё свежий, негатив (TTL 0.5 дня) перепроверяется
+            self._age("aspy_meta", "pos", 1)
+            self._age("aspy_meta", "neg", 1)
+            self.assertEqual(nba.aspy_enrich_cached("pos", None, 3, 0.5), positive)
+            self.assertEqual(nba.aspy_enrich_cached("neg", None, 3, 0.5), negative)
+            self.assertEqual([c.args[0] for c in m.call_args_list], ["pos", "neg", "neg"])
+
+            # позитив старше основного TTL — тоже перезапрашивается
+            self._age("aspy_meta", "pos", 4)
+            nba.aspy_enrich_cached("pos", None, 3, 0.5)
+            self.assertEqual(m.call_count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import niche_brand_audit as nba
+
+
+def _fake_play(kw, lang, cc, topn, ttl_days, limiter=None):
+    # 4 кандидата на бренд; у более поздних в выдаче installs/day больше
+    return [
+        {"appId": f"{kw}.{i}", "title": f"{kw} {i}", "url": f"https://play/{kw}.{i}"}
+        for i in range(4)
+    ]
+
+
+def _fake_meta(app_id, session, ttl_days, negative_ttl_days=0.5, limiter=None):
+    return {"daily": 100 * (int(app_id.rsplit(".", 1)[1]) + 1), "banned": False}
+
+
+class EnrichTopnTest(unittest.TestCase):
+    def _run(self, enrich_topn):
+        with mock.patch.object(nba, "play_search_cached", side_effect=_fake_play), \
+                mock.patch.object(nba, "aspy_enrich_cached", side_effect=_fake_meta) as meta:
+            rows = list(nba.audit_country_all_brands(
+                "pl", nba.build_keyapp_title_index([]), object(), topn=4,
+                play_sleep=0, aspy_sleep=0, enrich_topn=enrich_topn,
+            ))
+        return rows, {c.args[0] for c in meta.call_args_list}
+
+    def test_only_first_n_candidates_enriched(self):
+        rows, enriched = self._run(2)
+        self.assertTrue(rows)
+        self.assertEqual({a.rsplit(".", 1)[1] for a in enriched}, {"0", "1"})
+        for row in rows:
+            # конкурент — лучший из обогащённых; хвост в сводке без данных
+            self.assertTrue(row[3].endswith(".1"), row)
+            self.assertEqual(row[6], 200)
+            self.assertIn("::-::?", row[8])
+
+    def test_default_enriches_all(self):
+        rows, enriched = self._run(None)
+        self.assertEqual({a.rsplit(".", 1)[1] for a in enriched}, {"0", "1", "2", "3"})
+        self.assertTrue(all(row[3].endswith(".3") for row in rows))
+
+    def test_cli_rejects_below_one(self):
+        argv = ["niche_brand_audit.py", "--api-key", "K", "--enrich-topn", "0"]
+        with mock.patch.object(sys, "argv", argv), contextlib.redirect_stderr(io.StringIO()), \
+                self.assertRaises(SystemExit) as cm:
+            nba.main()
+        self.assertEqual(cm.exception.code, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
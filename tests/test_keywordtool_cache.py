@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import keywordtool_fetch as kt
+
+
+def _fake_response(keywords):
+    return {"results": {k: {"string": k, "volume": len(k) * 10, "cmp": 0.1} for k in keywords}}
+
+
+class KtCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)  # KT_CACHE_DIR относительный (.ktcache/)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_write_read_expire(self):
+        path = kt._kt_cache_path(["betano", "sts"], 2616, "pl", "googlesearch")
+        self.assertIsNone(kt._read_kt_cache(path, 3))  # промах: файла нет
+
+        data = _fake_response(["betano", "sts"])
+        kt._write_kt_cache(path, data)
+        self.assertEqual(kt._read_kt_cache(path, 3), data)
+
+        old = time.time() - 3 * 86400 - 1
+        os.utime(path, (old, old))
+        self.assertIsNone(kt._read_kt_cache(path, 3))
+        self.assertEqual(kt._read_kt_cache(path, 4), data)
+
+    def test_key_ignores_keyword_order(self):
+        a = kt._kt_cache_path(["a", "b"], 1, "pt", "googlesearch")
+        self.assertEqual(a, kt._kt_cache_path(["b", "a"], 1, "pt", "googlesearch"))
+        self.assertNotEqual(a, kt._kt_cache_path(["a", "b"], 1, "pt", "googlesearchnetwork"))
+
+    def test_corrupt_entry_is_a_miss(self):
+        path = kt._kt_cache_path(["x"], 1, "pt", "googlesearch")
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("{not json", encoding="utf-8")
+        self.assertIsNone(kt._read_kt_cache(path, 3))
+
+    def test_fetch_for_country_hits_cache_on_rerun(self):
+        calls = []
+
+        def fake_request(**kw):
+            calls.append(len(kw["keywords"]))
+            return _fake_response(kw["keywords"])
+
+        args = dict(
+            api_key="K", country_code="pl", only_canon=True, batch_size=5,
+            metrics_network="googlesearch", sleep_between=0, retries=1, backoff=1, timeout=1,
+            workers=2, cache_ttl_days=3,
+        )
+        with mock.patch.object(kt, "request_keywordtool", side_effect=fake_request), \
+                mock.patch("builtins.print"):
+            first = kt.fetch_for_country(**args)
+            n_first = len(calls)
+            second = kt.fetch_for_country(**args)
+
+        self.assertGreater(n_first, 0)
+        self.assertEqual(len(calls), n_first)  # второй прогон целиком из кэша
+        self.assertEqual(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import unicodedata
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import niche_brand_audit as nba
+
+
+def _baseline_tokens(s):
+    """Исходный токенизатор: NFKD без combining-знаков, токены [a-z0-9]+ длиной >= 3."""
+    s = (s or "").lower().strip()
+    s = ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
+    return [t for t in re.findall(r"[a-z0-9]+", s) if len(t) >= 3]
+
+
+class NormalizeTokensTest(unittest.TestCase):
+    SAMPLES = [
+        "Betano•Sports",
+        "Superbet–Zakłady",
+        "Fortuna·Casino",
+        "Strasse—Straße Bet",
+        "Bet365 — ставки на спорт",
+        "STS zakłady bukmacherskie",
+        "Café Apostas — Jogo",
+        "ﬁfa ²⁰²⁴ Ｂｅｔ",
+        "Ⅻ Ağır Bahis ıspanak",
+        "",
+        "plain ascii title",
+    ]
+
+    def test_matches_baseline_on_separators(self):
+        for s in self.SAMPLES:
+            with self.subTest(s=s):
+                self.assertEqual(list(nba._normalize_tokens(s)), _baseline_tokens(s))
+
+    def test_separator_keeps_brand_used(self):
+        index = nba.build_keyapp_title_index(["Betano•Sports", "Superbet–Zakłady", "Fortuna·Casino"])
+        for brand in ("Betano", "Superbet", "Fortuna"):
+            with self.subTest(brand=brand):
+                self.assertTrue(nba.brand_used_in_titles(brand, index))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import unicodedata
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import rank_competitors as rc
+from brands_catalog import get_reverse_index
+
+
+def _old_norm_basic(s):
+    """Исходная построчная нормализация (до векторизации)."""
+    s = (str(s) if s is not None else "").strip().lower()
+    s = "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", "", s)
+
+
+def _old_canon(country_code, s):
+    """Исходный построчный _canon; пустая ячейка (NaN) — пустая строка, как в _norm_basic_series."""
+    if s is None or (isinstance(s, float) and np.isnan(s)):
+        s = ""
+    norm = _old_norm_basic(s)
+    if country_code:
+        try:
+            c = get_reverse_index(country_code).get(norm)
+            if c:
+                return c
+        except KeyError:
+            pass
+    return norm
+
+
+class CanonSeriesTest(unittest.TestCase):
+    KEYS = [
+        "Betano", " BETANO ", "Bétano", "bet 365", "Bet-365", "Superbet", "Zakłady STS", "sts",
+        "LV Bet", "ﬁfa bet", "ставка", "Straße", None, np.nan, "", "Fortuna", "Pixbet", "unknown brand",
+    ]
+
+    def _codes(self):
+        cycle = ["br", "pl", None, "zz"]
+        return [cycle[i % len(cycle)] for i in range(len(self.KEYS))]
+
+    def test_matches_per_row_mixed_countries(self):
+        keys = pd.Series(self.KEYS, dtype=object)
+        codes = self._codes()
+        got = rc._canon_series(keys, pd.Series(codes, index=keys.index, dtype=object))
+        expected = [_old_canon(cc, k) for cc, k in zip(codes, self.KEYS)]
+        self.assertEqual(got.tolist(), expected)
+
+    def test_matches_per_row_single_country(self):
+        keys = pd.Series(self.KEYS, dtype=object)
+        for cc in ("br", "pl"):
+            with self.subTest(cc=cc):
+                got = rc._canon_series(keys, cc)
+                self.assertEqual(got.tolist(), [_old_canon(cc, k) for k in self.KEYS])
+
+    def test_keeps_index(self):
+        keys = pd.Series(["Betano", "STS"], index=[10, 3])
+        self.assertEqual(rc._canon_series(keys, "pl").index.tolist(), [10, 3])
+
+
+class RankTest(unittest.TestCase):
+    def _merged(self):
+        return pd.DataFrame({
+            "ключ": ["a", "b", "c", "d", "e", "f"],
+            "конкурент": ["x", "", "y", "", "z", ""],
+            "конкурент в бане": ["Нет", "", "Да", "", "Нет", ""],
+            "инстайлы в день": pd.array([10, pd.NA, 5, pd.NA, 1, pd.NA], dtype="Int64"),
+            "Юзаный": pd.Series(["Нет", "Нет", "Да", " нет ", "Нет", "Нет"], dtype="category"),
+            "страна": pd.Series(["Бразилия", "Бразилия", "Польша", "Польша", "Польша", "Бразилия"],
+                                dtype="category"),
+            "search_volume": [100.0, 5000.0, 700.0, 50.0, 700.0, 0.0],
+        })
+
+    def test_caps_keep_rows_with_competitor(self):
+        out = rc.rank(self._merged(), cap_upper=600)
+        # «b» без конкурента выше капа — выпадает; «c»/«e» выше капа, но с конкурентом — остаются
+        self.assertEqual(out["ключ"].tolist(), ["c", "e", "a", "d", "f"])
+
+    def test_filters_and_stable_sort(self):
+        out = rc.rank(self._merged(), only_nonused=True, cap_lower=50)
+        # «c» — юзаный; «f» ниже нижнего капа и без конкурента; равные объёмы — в порядке аудита
+        self.assertEqual(out["ключ"].tolist(), ["b", "e", "a", "d"])
+        self.assertEqual(out["объем запросов"].tolist(), [5000, 700, 100, 50])
+        self.assertEqual(list(out.columns), rc.OUTPUT_COLUMNS)
+
+    def test_top_per_country(self):
+        out = rc.rank(self._merged(), sort_by="country", top_per_country=1)
+        self.assertEqual(out["ключ"].tolist(), ["b", "c"])
+
+    def test_presorted_slice_equals_full_rank(self):
+        merged = self._merged()
+        base = rc.sort_frame(merged)
+        for cap in (None, 60, 600, 10_000):
+            with self.subTest(cap=cap):
+                pd.testing.assert_frame_equal(
+                    rc.rank(base, cap_upper=cap, presorted=True), rc.rank(merged, cap_upper=cap)
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()